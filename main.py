@@ -4,6 +4,9 @@ Irene - 围棋AI主程序
 使用方法:
     python main.py gtp                  # 启动GTP协议服务
     python main.py gtp MCTS             # 启动GTP协议服务(MCTS模式)
+    python main.py gtp MCTS --backend bitboard  # 使用位棋盘实现
+    python main.py gtp MCTS --ponder    # 对方思考时在后台继续搜索
+    python main.py gtp MCTS --search-threads 8  # 8 个线程并行搜索
     python main.py train policy         # 训练策略网络
     python main.py train playout        # 训练快速策略网络
     python main.py train value          # 训练价值网络
@@ -27,6 +30,32 @@ def main():
     gtp = cmd.add_parser('gtp', help='启动GTP协议服务')
     gtp.add_argument('mode', nargs='?', default='PolicyNet', choices=[
                      'PolicyNet', 'MCTS'], help='GTP模式，默认为PolicyNet，MCTS为蒙特卡洛树搜索模式')
+    gtp.add_argument('--backend', default='array', choices=['array', 'bitboard'],
+                     help='棋盘实现，默认为array，bitboard为位棋盘')
+    gtp.add_argument('--board-size', type=int, default=19,
+                     help='棋盘大小，默认为19，9路等小棋盘需要对应的模型，如models/policyNet_9x9.pt')
+    gtp.add_argument('--value', default='net', choices=['net', 'score'],
+                     help='MCTS叶节点评估方式，默认为net(价值网络)，score为数子')
+    gtp.add_argument('--symmetries', type=int, default=1, choices=range(1, 9), metavar='{1..8}',
+                     help='选择落子时策略网络平均的棋盘对称变换数，默认为1(只用原局面)，8为全部对称变换')
+    gtp.add_argument('--selection', default='ucb1', choices=['ucb1', 'puct'],
+                     help='MCTS选择子节点的方式，默认为ucb1，puct使用策略网络先验')
+    gtp.add_argument('--candidates', type=int, default=None,
+                     help='MCTS每个节点保留的候选落子数，默认puct为全部合法落子，ucb1为5')
+    gtp.add_argument('--search-batch', type=int, default=1,
+                     help='MCTS每轮用虚拟损失收集并批量评估的叶节点数，默认为1(逐个评估)')
+    gtp.add_argument('--ponder', action='store_true',
+                     help='MCTS模式下在对方思考时继续在后台搜索，收到下一条命令时停止')
+    gtp.add_argument('--search-threads', type=int, default=1,
+                     help='MCTS并行搜索的线程（tree，共用搜索次数，每个线程每次评估search-batch个叶节点）或进程（root，每个增加同样的搜索次数）数，默认为1')
+    gtp.add_argument('--parallel', default='tree', choices=['tree', 'root'],
+                     help='并行方式：tree为多线程共用一棵树（虚拟损失、共用推理队列），root为多进程各自搜索后合并根节点（需要支持fork的平台，Windows上改用tree）')
+    gtp.add_argument('--transpositions', action='store_true',
+                     help='MCTS使用置换表，不同走法到达的同一局面共用评估和子节点')
+    gtp.add_argument('--cache-mb', type=float, default=256,
+                     help='网络评估结果缓存的内存上限（MB），按最近最少使用淘汰，默认为256，0为不缓存')
+    gtp.add_argument('--rollout-depth', type=int, default=5,
+                     help='MCTS每个叶节点用快速策略网络模拟的步数，默认为5，0为不模拟、只用价值网络评估')
     train = cmd.add_parser('train', help='训练网络')
     train.add_argument('network_type', choices=['policy', 'playout', 'value'],
                        help='指定要训练的网络类型: policy(策略网络), playout(快速策略网络), value(价值网络)')
@@ -38,7 +67,10 @@ def main():
     # 根据命令行参数执行相应的功能
     if args.command == 'gtp':
         from src.interface.gtp import main as gtp_main
-        gtp_main(args.mode=='MCTS')
+        gtp_main(args.mode=='MCTS', args.backend, args.value, args.board_size, args.symmetries,
+                 args.selection, args.candidates, args.search_batch, args.ponder,
+                 args.search_threads, args.parallel, args.transpositions, args.cache_mb,
+                 args.rollout_depth)
 
     elif args.command == 'train':
         from src.training.trainer import main as train_main
@@ -26,6 +26,12 @@ def main():
                         help='是否保存对局记录，仅对自我对弈训练有效')
     parser.add_argument('--policy-only', action='store_true',
                         help='仅使用策略网络进行训练，不使用MCTS')
+    parser.add_argument('--board-size', type=int, default=19,
+                        help='棋盘大小，如 9 用于快速迭代，模型保存为 policyNet_9x9.pt 等')
+    parser.add_argument('--backend', type=str, default='array', choices=['array', 'bitboard'],
+                        help='棋盘实现，bitboard为位棋盘')
+    parser.add_argument('--selection', type=str, default='ucb1', choices=['ucb1', 'puct'],
+                        help='MCTS选择子节点的方式，默认为ucb1，puct使用策略网络先验')
 
     args = parser.parse_args()
     import torch
@@ -38,6 +44,9 @@ def main():
         checkpoint_interval=args.checkpoint_interval,
         save_games=args.save_games,
         policy_only=args.policy_only,
+        backend=args.backend,
+        board_size=args.board_size,
+        selection=args.selection,
         device='cuda' if torch.cuda.is_available() else 'cpu'
     )
 
@@ -1,21 +1,23 @@
 import torch
 import numpy as np
-from src.core.game import Go, toPosition, toDigit
-from src.core.features import getAllFeatures
+from src.core.game import Go, newGo, toPosition, toDigit
+from src.core.features import getAllFeatures, featureBuffer, packFeatures, unpackFeaturesTensor
 from src.ai.mcts import MCTSNode, MCTS
 
 class ReplayBuffer:
-    def __init__(self, capacity=10000):
+    def __init__(self, capacity=10000, board_size=19):
         self.capacity = capacity
-        self.states = []  # Board states
+        self.board_size = board_size
+        self.states = []  # Board states, bit-packed (about 680 bytes each on 19x19)
         self.policies = []  # Policy targets (MCTS visit counts)
         self.values = []  # Value targets (final game results)
         self.position = 0
         
     def push(self, state, policy, value):
-        # Ensure state and value are float32
+        # Store the binary feature planes bit-packed; ensure value is float32
         if isinstance(state, torch.Tensor):
-            state = state.float()
+            state = state.cpu().numpy()
+        state = torch.from_numpy(packFeatures(state))
         if isinstance(value, torch.Tensor):
             value = value.float()
             
@@ -31,7 +33,7 @@ class ReplayBuffer:
         
     def sample(self, batch_size):
         indices = np.random.choice(len(self.states), batch_size)
-        states = torch.stack([self.states[i] for i in indices])
+        states = unpackFeaturesTensor(torch.stack([self.states[i] for i in indices]), self.board_size)
         policies = torch.stack([self.policies[i] for i in indices])
         values = torch.stack([self.values[i] for i in indices])
         return states, policies, values
@@ -40,54 +42,63 @@ class ReplayBuffer:
         return len(self.states)
 
 class SelfPlayEnv:
-    def __init__(self, policy_net, value_net, playout_net, device='cuda'):
+    def __init__(self, policy_net, value_net, playout_net, device='cuda', backend='array', komi=7.5,
+                 board_size=19, selection='ucb1', candidates=None):
         self.device = device
+        self.backend = backend
+        # MCTS child selection ('puct' or 'ucb1') and candidate moves kept per node
+        self.selection = selection
+        self.candidates = candidates
+        self.komi = komi
+        self.board_size = board_size
         self.policy_net = policy_net.to(device)
         self.value_net = value_net.to(device)
         self.playout_net = playout_net.to(device)
-        self.go = Go()
-        self.replay_buffer = ReplayBuffer()
+        self.go = newGo(board_size, backend)
+        self.replay_buffer = ReplayBuffer(board_size=board_size)
         self.current_color = 1  # Black starts
         self.history = []
+        # Reusable network input (numpy array and tensor share memory); pinned for fast GPU copies
+        self.input_array, self.input_tensor = featureBuffer(
+            1, board_size, pinMemory=str(device).startswith('cuda'))
         
     def reset(self):
-        self.go = Go()
+        self.go = newGo(self.board_size, self.backend)
         self.current_color = 1
         self.history = []
         return self._get_state()
     
     def _get_state(self):
-        return torch.tensor(getAllFeatures(self.go, self.current_color)).bool()
+        return torch.from_numpy(getAllFeatures(self.go, self.current_color)).bool()
+
+    def _get_input(self, go, will_play_color):
+        """Write features into the reusable input buffer and return it on the device"""
+        getAllFeatures(go, will_play_color, out=self.input_array[0])
+        return self.input_tensor.to(self.device, non_blocking=True)
     
+    def _get_valid_mask(self):
+        """Boolean mask over board points (pass excluded) of legal moves"""
+        return self.go.legal_moves_mask(self.current_color)[:-1]
+
     def _get_valid_moves(self):
-        valid_moves = []
-        for x in range(19):
-            for y in range(19):
-                # Use temporary board to check move validity
-                temp_go = self.go.clone()
-                if temp_go.move(self.current_color, x, y):
-                    valid_moves.append((x, y))
-        return valid_moves
+        return [toPosition(digit, self.board_size) for digit in np.flatnonzero(self._get_valid_mask())]
     
     @torch.no_grad()
     def get_policy(self, go, will_play_color):
         """Get policy network prediction"""
-        input_data = getAllFeatures(go, will_play_color)
-        input_data = torch.tensor(input_data).bool().reshape(1, -1, 19, 19).to(self.device)
+        input_data = self._get_input(go, will_play_color)
         predict = self.policy_net(input_data)[0].detach().cpu()
         return predict
     @torch.no_grad()
     def get_playout_policy(self, go, will_play_color):
         """Get playout network prediction"""
-        input_data = getAllFeatures(go, will_play_color)
-        input_data = torch.tensor(input_data).bool().reshape(1, -1, 19, 19).to(self.device)
+        input_data = self._get_input(go, will_play_color)
         predict = self.playout_net(input_data)[0].detach().cpu()
         return predict
     @torch.no_grad()
     def get_value(self, go, will_play_color):
         """Get value network prediction"""
-        input_data = getAllFeatures(go, will_play_color)
-        input_data = torch.tensor(input_data).bool().reshape(1, -1, 19, 19).to(self.device)
+        input_data = self._get_input(go, will_play_color)
         value = self.value_net(input_data)[0].detach().cpu().item()
         return value
     
@@ -96,23 +107,17 @@ class SelfPlayEnv:
         """Get move probabilities directly from policy network"""
         policy = self.get_policy(self.go, self.current_color)
         
-        # Get valid moves
-        valid_moves = self._get_valid_moves()
-        
         # Find best valid move
         best_move = None
-        best_prob = float('-inf')
-        
-        for x, y in valid_moves:
-            prob = policy[toDigit(x, y)]
-            if prob > best_prob:
-                best_prob = prob
-                best_move = (x, y)
+        valid_mask = torch.from_numpy(self._get_valid_mask())
+        if valid_mask.any():
+            masked = policy[:-1].masked_fill(~valid_mask, float('-inf'))
+            best_move = toPosition(torch.argmax(masked), self.board_size)
         
         # If no valid moves found, pass
         if best_move is None:
             best_move = (None, None)
-            policy = torch.zeros(19*19 + 1)
+            policy = torch.zeros(self.board_size * self.board_size + 1)
             policy[-1] = 1.0  # All probability on pass move
         
         return policy, best_move
@@ -132,24 +137,26 @@ class SelfPlayEnv:
             self.get_policy,
             self.get_playout_policy,
             self.get_value,
-            iterations=200  # Default MCTS iterations
+            iterations=200,  # Default MCTS iterations
+            selection=self.selection,
+            candidates=self.candidates
         )
         
         # Extract policy from visit counts
-        policy = torch.zeros(19*19 + 1)  # Include pass move
+        policy = torch.zeros(self.board_size * self.board_size + 1)  # Include pass move
         total_visits = sum(c.N for c in root.children) if root.children else 1
         
         for child in root.children:
-            # Get the last move from child's go history
-            if len(child.go.history) > len(root.go.history):
-                x, y = child.go.history[-1]
-                policy[toDigit(x, y)] = child.N / total_visits
+            # Get the move that leads to the child
+            if child.move is not None:
+                x, y = child.move
+                policy[toDigit(x, y, self.board_size)] = child.N / total_visits
             else:  # Pass move
                 policy[-1] = child.N / total_visits
                 
         # Get best move from best node
-        if best_node and len(best_node.go.history) > len(root.go.history):
-            best_move = best_node.go.history[-1]
+        if best_node and best_node.move is not None:
+            best_move = best_node.move
         else:
             best_move = (None, None)  # Pass move
                 
@@ -174,8 +181,7 @@ class SelfPlayEnv:
         
         # Also check if no valid moves left
         if not game_over:
-            valid_moves = self._get_valid_moves()
-            game_over = len(valid_moves) == 0
+            game_over = not self._get_valid_mask().any()
         
         # Calculate immediate reward
         reward = self._calculate_reward()
@@ -189,41 +195,41 @@ class SelfPlayEnv:
         
     def _calculate_reward(self):
         """Calculate reward for the current state"""
-        # Territory-based reward
-        black_territory = np.sum(self.go.board == 1)
-        white_territory = np.sum(self.go.board == -1)
+        board = self.go.board
+
+        # Territory-based reward (area scoring: stones plus surrounded empty points)
+        territory = self.go.score(komi=0)
         
         # Favor center control
-        center_x, center_y = 9, 9
-        center_influence = 0
-        for dx in [-1, 0, 1]:
-            for dy in [-1, 0, 1]:
-                x, y = center_x + dx, center_y + dy
-                if 0 <= x < 19 and 0 <= y < 19:
-                    center_influence += self.go.board[x][y] * self.current_color
+        center = self.board_size // 2
+        center_influence = np.sum(board[center - 1:center + 2, center - 1:center + 2], dtype=np.int64) * self.current_color
                     
         # Liberty-based reward
-        liberty_reward = 0
-        for x in range(19):
-            for y in range(19):
-                if self.go.board[x][y] == self.current_color:
-                    liberty_reward += self.go.liberty[x, y]
+        liberty_reward = np.sum(self.go.liberty[board == self.current_color], dtype=np.int64)
                     
         # Combine rewards
         reward = (
-            0.5 * (black_territory - white_territory) * self.current_color +
+            0.5 * territory * self.current_color +
             0.3 * center_influence +
             0.2 * liberty_reward
         )
         
         return reward
     
+    def get_outcome(self):
+        """Final area score (positive: black wins) and the winning color (0 for a tie)"""
+        score = self.go.score(self.komi)
+        return score, int(np.sign(score))
+
     def save_game_history(self, filename):
         """Save game history to file"""
         import json
+        score, winner = self.get_outcome()
         history_data = {
             'moves': [(x, y, color) for x, y, color in self.history],
-            'final_board': self.go.board.tolist()
+            'final_board': self.go.board.tolist(),
+            'score': score,
+            'winner': winner
         }
         with open(filename, 'w') as f:
             json.dump(history_data, f)
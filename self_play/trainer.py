@@ -2,22 +2,20 @@ import os
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from src.ai.networks import PolicyNetwork, ValueNetwork, PlayoutNetwork
+from src.ai.networks import PolicyNetwork, ValueNetwork, PlayoutNetwork, model_file_name
 from self_play.self_play_env import SelfPlayEnv
 
-def setup_networks(models_dir, device='cuda'):
+def setup_networks(models_dir, device='cuda', board_size=19):
     """Initialize or load networks from checkpoints"""
-    policy_net = PolicyNetwork().to(device)
-    value_net = ValueNetwork().to(device)
-    playout_net = PlayoutNetwork().to(device)
+    policy_net = PolicyNetwork(board_size).to(device)
+    value_net = ValueNetwork(board_size).to(device)
+    playout_net = PlayoutNetwork(board_size).to(device)
     
     # Load existing models if available
-    if os.path.exists(os.path.join(models_dir, 'policyNet.pt')):
-        policy_net.load_state_dict(torch.load(os.path.join(models_dir, 'policyNet.pt')))
-    if os.path.exists(os.path.join(models_dir, 'valueNet.pt')):
-        value_net.load_state_dict(torch.load(os.path.join(models_dir, 'valueNet.pt')))
-    if os.path.exists(os.path.join(models_dir, 'playoutNet.pt')):
-        playout_net.load_state_dict(torch.load(os.path.join(models_dir, 'playoutNet.pt')))
+    for net, name in [(policy_net, 'policyNet'), (value_net, 'valueNet'), (playout_net, 'playoutNet')]:
+        path = os.path.join(models_dir, model_file_name(name, board_size))
+        if os.path.exists(path):
+            net.load_state_dict(torch.load(path))
         
     return policy_net, value_net, playout_net
 
@@ -72,7 +70,7 @@ def train_playout(playout_net, states, policies, optimizer):
     
     return loss.item()
 
-def save_checkpoint(policy_net, value_net, playout_net, checkpoint_dir, epoch):
+def save_checkpoint(policy_net, value_net, playout_net, checkpoint_dir, epoch, board_size=19):
     """Save network checkpoints"""
     os.makedirs(checkpoint_dir, exist_ok=True)
     
@@ -85,9 +83,9 @@ def save_checkpoint(policy_net, value_net, playout_net, checkpoint_dir, epoch):
               os.path.join(checkpoint_dir, f'playout_net_epoch_{epoch}.pt'))
     
     # Also save as latest models
-    torch.save(policy_net.state_dict(), os.path.join('models', 'policyNet.pt'))
-    torch.save(value_net.state_dict(), os.path.join('models', 'valueNet.pt'))
-    torch.save(playout_net.state_dict(), os.path.join('models', 'playoutNet.pt'))
+    torch.save(policy_net.state_dict(), os.path.join('models', model_file_name('policyNet', board_size)))
+    torch.save(value_net.state_dict(), os.path.join('models', model_file_name('valueNet', board_size)))
+    torch.save(playout_net.state_dict(), os.path.join('models', model_file_name('playoutNet', board_size)))
 
 def self_play_training(
     models_dir='models',
@@ -99,11 +97,14 @@ def self_play_training(
     checkpoint_interval=10,
     save_games=True,
     policy_only=False,
-    device='cuda'
+    device='cuda',
+    backend='array',
+    board_size=19,
+    selection='ucb1'
 ):
     """Main self-play training loop"""
     # Setup networks and optimizers
-    policy_net, value_net, playout_net = setup_networks(device)
+    policy_net, value_net, playout_net = setup_networks(models_dir, device, board_size)
     
     policy_optimizer = optim.Adam(policy_net.parameters(), lr=0.001)
     value_optimizer = optim.Adam(value_net.parameters(), lr=0.001)
@@ -115,7 +116,8 @@ def self_play_training(
     playout_scheduler = optim.lr_scheduler.StepLR(playout_optimizer, step_size=5, gamma=0.1)
     
     # Create self-play environment
-    env = SelfPlayEnv(policy_net, value_net, playout_net, device)
+    env = SelfPlayEnv(policy_net, value_net, playout_net, device, backend, board_size=board_size,
+                      selection=selection)
     
     # Create directories
     os.makedirs('models', exist_ok=True)
@@ -146,11 +148,11 @@ def self_play_training(
                     if move_info is None:
                         break  # End game if no valid moves
                         
-                    # Get the last move by comparing history lengths
-                    if len(move_info.go.history) <= len(env.go.history):
+                    # Get the move that leads to the chosen node
+                    if move_info.move is None:
                         break  # No new move was made
                         
-                    last_move = move_info.go.history[-1]  # Get latest move
+                    last_move = move_info.move  # Get latest move
                 
                 # Execute move
                 next_state, reward, game_over = env.step(last_move)
@@ -191,7 +193,7 @@ def self_play_training(
         
         # Save checkpoints
         if (epoch + 1) % checkpoint_interval == 0:
-            save_checkpoint(policy_net, value_net, playout_net, checkpoint_dir, epoch + 1)
+            save_checkpoint(policy_net, value_net, playout_net, checkpoint_dir, epoch + 1, board_size)
 
 def main():
     """Main function"""
@@ -3,6 +3,6 @@ AI模块
 包含神经网络、MCTS算法和AI引擎
 """
 
-from .networks import PolicyNetwork, PlayoutNetwork, ValueNetwork
+from .networks import PolicyNetwork, PlayoutNetwork, ValueNetwork, model_file_name
 from .mcts import MCTSNode, MCTS
 from .engine import Engine
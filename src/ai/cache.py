@@ -0,0 +1,63 @@
+from collections import OrderedDict
+import torch
+
+# Rough per-entry cost of the key tuple, the dictionary slot and the result object besides its data
+ENTRY_OVERHEAD = 256
+
+
+def result_bytes(result):
+    """Memory held by a cached network result (a tensor or a float)"""
+    if isinstance(result, torch.Tensor):
+        return result.element_size() * result.nelement() + ENTRY_OVERHEAD
+    return ENTRY_OVERHEAD
+
+
+class EvaluationCache:
+    """
+    LRU cache of network results. The total size of the stored results is kept under max_bytes by
+    evicting the least recently used entries; hits and misses count the lookups.
+    """
+
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Cached result for key (marked as recently used), None on a miss"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key, result):
+        """Store result for key, evicting old entries beyond the memory cap"""
+        if self.max_bytes <= 0:
+            return
+        size = result_bytes(result)
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self.entries[key] = (result, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, freed) = self.entries.popitem(last=False)
+            self.bytes -= freed
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0
+        return (f'{self.hits} hits, {self.misses} misses ({rate:.1%}), {len(self.entries)} entries, '
+                f'{self.bytes / 2 ** 20:.1f} MB')
@@ -2,16 +2,57 @@ import torch
 import numpy as np
 import sys
 import os
-from src.ai.networks import PolicyNetwork, PlayoutNetwork, ValueNetwork
-from src.core.game import Go, toPosition, toStrPosition
-from src.core.features import getAllFeatures
-from src.ai.mcts import MCTSNode, MCTS
+import threading
+import time
+from src.ai.networks import PolicyNetwork, PlayoutNetwork, ValueNetwork, model_file_name
+from src.core.game import Go, newGo, areaScores, toPosition, toStrPosition
+from src.core.features import getAllFeaturesBatch, featureBuffer, transformPlanes, restorePlanes, SYMMETRY_COUNT
+from src.ai.mcts import (MCTSNode, MCTS, MCTSRootParallel, reuseTree, ROLLOUT_DEPTH, PARALLEL_MODES,
+                         rootParallelSupported)
+from src.ai.timecontrol import TimeControl, deadline_stop
+from src.ai.cache import EvaluationCache
 
 device = 'cuda' if torch.cuda.is_available() else 'cpu'
 
 class Engine:
 
-    def __init__(self, path=None):
+    def __init__(self, path=None, backend='array', komi=7.5, value_source='net', board_size=19,
+                 root_symmetries=1, selection='ucb1', candidates=None, search_batch=1,
+                 max_visits=10000, search_threads=1, parallel='tree', transpositions=False, cache_mb=256,
+                 rollout_depth=ROLLOUT_DEPTH):
+        # Board implementation used for new games and MCTS ('array' or 'bitboard')
+        self.backend = backend
+        # Board size the networks were trained for (models/policyNet_9x9.pt etc. for small boards)
+        self.board_size = board_size
+        # Komi used by area scoring (GTP komi command updates it)
+        self.komi = komi
+        # Board symmetries averaged when choosing the move to play (MCTS root / policy move)
+        self.root_symmetries = root_symmetries
+        # MCTS child selection ('puct' or 'ucb1') and candidate moves kept per node (None: mode default)
+        self.selection = selection
+        self.candidates = candidates
+        # Leaves collected (with virtual loss) and evaluated together per MCTS round; 1 evaluates one at a time
+        self.search_batch = search_batch
+        # Parallel search workers and how they share work: 'tree' (threads on one tree, each evaluating search_batch
+        # leaves at a time through a shared inference queue) or 'root' (processes searching their own copy, root
+        # statistics merged)
+        self.search_threads = search_threads
+        if parallel not in PARALLEL_MODES:
+            raise ValueError(f'unknown parallel mode: {parallel}')
+        if parallel == 'root' and not rootParallelSupported():
+            # Forked worker processes are not available (Windows)
+            sys.stderr.write('Root-parallel search needs fork, using tree-parallel search\n')
+            parallel = 'tree'
+        self.parallel = parallel
+        # Playout-network moves simulated from each MCTS leaf before it is evaluated; 0 uses the value only
+        self.rollout_depth = rollout_depth
+        # Share evaluations and children between nodes reaching the same position (MCTS transposition table)
+        self.transpositions = transpositions
+        # Most visits the kept tree grows to while pondering or in a timed search (bounds the tree's memory)
+        self.max_visits = max_visits
+        # Clocks from the GTP time commands; with a time limit genmove searches until its time budget runs out
+        self.time_control = TimeControl()
+
         # Set random seeds
         torch.manual_seed(0)
         torch.cuda.manual_seed_all(0)
@@ -22,56 +63,261 @@ class Engine:
             os.path.dirname(os.path.realpath(__file__)))) + '/models'
 
         # Load pre-trained models
-        self.policy_net = PolicyNetwork()
+        self.policy_net = PolicyNetwork(board_size)
         self.policy_net.load_state_dict(
-            torch.load(os.path.join(path, 'policyNet.pt')))
+            torch.load(os.path.join(path, model_file_name('policyNet', board_size))))
         self.policy_net.to(device)
         self.policy_net.eval()
 
-        self.playout_net = PlayoutNetwork()
+        self.playout_net = PlayoutNetwork(board_size)
         self.playout_net.load_state_dict(
-            torch.load(os.path.join(path, 'playoutNet.pt')))
+            torch.load(os.path.join(path, model_file_name('playoutNet', board_size))))
         self.playout_net.to(device)
         self.playout_net.eval()
 
-        self.value_net = ValueNetwork()
-        self.value_net.load_state_dict(torch.load(os.path.join(path, 'valueNet.pt')))
+        self.value_net = ValueNetwork(board_size)
+        value_net_path = os.path.join(path, model_file_name('valueNet', board_size))
+        if os.path.exists(value_net_path):
+            self.value_net.load_state_dict(torch.load(value_net_path))
+        else:
+            # Without a trained value network MCTS falls back to area scoring
+            value_source = 'score'
         self.value_net.to(device)
         self.value_net.eval()
 
+        # Leaf evaluation used by MCTS: 'net' (value network) or 'score' (area scoring)
+        self.value_source = value_source
+
+        # Reusable network inputs keyed by (batch size, board size): numpy array and tensor share memory
+        self.input_buffers = {}
+
+        # Network results of recently evaluated positions, bounded to cache_mb megabytes (0 disables it)
+        self.cache = EvaluationCache(int(cache_mb * 2 ** 20))
+
+        # Root of the last MCTS search, kept so the next search can reuse the subtree of the moves played since
+        self.search_root = None
+        # Background search on the kept tree during the opponent's turn, see start_pondering
+        self.ponder_thread = None
+        self.ponder_stop = threading.Event()
+
+    def new_go(self):
+        """Create an empty board with the engine's backend and board size"""
+        return newGo(self.board_size, self.backend)
+
+    def reset_search(self):
+        """Drop the kept search tree (new game or changed scoring)"""
+        self.stop_pondering()
+        self.search_root = None
+
+    def search(self, root, iterations=200, debug=False, deadline=None):
+        """
+        Run MCTS from root with the engine's settings and return the most visited child
+        Adds `iterations` visits, stopping early at `deadline` (time.monotonic()) if given; tree-parallel threads
+        share them, each root-parallel process adds its own and the search returns a child of a merged tree
+        """
+        stop = deadline_stop(deadline) if deadline is not None else None
+        if self.search_threads > 1 and self.parallel == 'root':
+            return MCTSRootParallel(root, self.search_tree, self.search_threads, iterations, stop)
+        return self.search_tree(root, iterations, debug, stop)
+
+    def search_tree(self, root, iterations=200, debug=False, stop=None):
+        """MCTS adding `iterations` visits to root's tree, run by search_threads threads in 'tree' mode"""
+        threads = self.search_threads if self.parallel == 'tree' else 1
+        return MCTS(
+            root,
+            self.get_policy_net_result,
+            self.get_playout_net_result,
+            self.get_mcts_value_function(),
+            iterations=iterations,
+            debug=debug,
+            backend=self.backend,
+            rootSymmetries=self.root_symmetries,
+            selection=self.selection,
+            candidates=self.candidates,
+            batchSize=self.search_batch,
+            getPolicyNetResults=self.get_policy_net_results,
+            getPlayoutNetResults=self.get_playout_net_results,
+            getValueNetResults=self.get_mcts_value_batch_function(),
+            stop=stop,
+            threads=threads,
+            transpositions=self.transpositions,
+            rolloutDepth=self.rollout_depth
+        )
+
+    def start_pondering(self, go, will_play_color):
+        """Keep searching go (the opponent to play) on a background thread until stop_pondering"""
+        self.stop_pondering()
+        root = self.search_root_for(go, will_play_color)
+        self.search_root = root
+        iterations = self.max_visits - root.N
+        if iterations <= 0:
+            return
+        self.ponder_stop.clear()
+        self.ponder_thread = threading.Thread(
+            target=self.search_tree, args=(root, iterations), kwargs={'stop': self.ponder_stop.is_set}, daemon=True)
+        self.ponder_thread.start()
+
+    def stop_pondering(self):
+        """Stop the background search within one network call; finished visits stay in the kept tree"""
+        if self.ponder_thread is None:
+            return
+        self.ponder_stop.set()
+        self.ponder_thread.join()
+        self.ponder_thread = None
+        sys.stderr.write(f'Pondered until {self.search_root.N} visits\n')
+
+    def search_root_for(self, go, will_play_color):
+        """Root for searching go: the kept tree advanced by the moves played since, or a fresh tree"""
+        if self.search_root is not None:
+            root = reuseTree(self.search_root, go, will_play_color)
+            if root is not None:
+                sys.stderr.write(f'Reusing search tree with {root.N} visits\n')
+                return root
+        return MCTSNode(go, will_play_color, None)
+
+    def input_tensor(self, gos, will_play_colors):
+        """Write the features of each position into a reusable buffer and return it on the device"""
+        key = (len(gos), gos[0].size)
+        buffer = self.input_buffers.get(key)
+        if buffer is None:
+            # Pinned host memory lets the copy to the GPU run asynchronously
+            buffer = featureBuffer(*key, pinMemory=device == 'cuda')
+            self.input_buffers[key] = buffer
+        input_array, input_tensor = buffer
+        getAllFeaturesBatch(gos, will_play_colors, out=input_array)
+        return input_tensor.to(device, non_blocking=True)
+
+    def pick_symmetries(self, symmetries):
+        """Board symmetries to evaluate: the identity for 1, all 8 for 8, otherwise a random subset"""
+        if symmetries <= 1:
+            return [0]
+        if symmetries >= SYMMETRY_COUNT:
+            return list(range(SYMMETRY_COUNT))
+        return np.random.choice(SYMMETRY_COUNT, symmetries, replace=False).tolist()
+
+    def symmetry_input_tensor(self, go, will_play_color, chosen):
+        """One position under each chosen symmetry, stacked into a single batch"""
+        input_data = self.input_tensor([go], [will_play_color])
+        if chosen == [0]:
+            return input_data
+        return torch.stack([transformPlanes(input_data[0], symmetry) for symmetry in chosen])
+
+    def restore_policy(self, predicts, chosen, size):
+        """Rotate each policy output back to the original orientation and average them"""
+        if chosen == [0]:
+            return predicts[0]
+        area = size * size
+        boards = predicts[:, :area].reshape(-1, size, size)
+        restored = torch.stack([restorePlanes(board, symmetry) for board, symmetry in zip(boards, chosen)])
+        return torch.cat((restored.reshape(-1, area), predicts[:, area:]), dim=1).mean(dim=0)
+
+    def cache_key(self, network, go, will_play_color, symmetries=1):
+        """
+        Evaluation cache key: network, symmetries averaged, position hash with the side to move, and the
+        last three moves (the features mark them, so positions reached by other move orders differ)
+        """
+        return network, symmetries, go.hashKey(will_play_color), tuple(go.history[-3:])
+
     @torch.no_grad()
-    def get_policy_net_result(self, go, will_play_color):
-        """Get policy network prediction"""
-        input_data = getAllFeatures(go, will_play_color)
-        input_data = torch.tensor(input_data).bool().reshape(1, -1, 19, 19).to(device)
-        predict = self.policy_net(input_data)[0].detach().cpu()
+    def get_policy_net_result(self, go, will_play_color, symmetries=1):
+        """Get policy network prediction, averaged over `symmetries` board symmetries in one batch"""
+        key = self.cache_key('policy', go, will_play_color, symmetries)
+        predict = self.cache.get(key)
+        if predict is None:
+            chosen = self.pick_symmetries(symmetries)
+            input_data = self.symmetry_input_tensor(go, will_play_color, chosen)
+            predicts = self.policy_net(input_data).detach().cpu()
+            predict = self.restore_policy(predicts, chosen, go.size)
+            self.cache.put(key, predict)
         return predict
 
     @torch.no_grad()
-    def get_playout_net_result(self, go, will_play_color):
-        """Get playout network prediction"""
-        input_data = getAllFeatures(go, will_play_color)
-        input_data = torch.tensor(input_data).bool().reshape(1, -1, 19, 19).to(device)
-        predict = self.playout_net(input_data)[0].detach().cpu()
+    def get_playout_net_result(self, go, will_play_color, symmetries=1):
+        """Get playout network prediction, averaged over `symmetries` board symmetries in one batch"""
+        key = self.cache_key('playout', go, will_play_color, symmetries)
+        predict = self.cache.get(key)
+        if predict is None:
+            chosen = self.pick_symmetries(symmetries)
+            input_data = self.symmetry_input_tensor(go, will_play_color, chosen)
+            predicts = self.playout_net(input_data).detach().cpu()
+            predict = self.restore_policy(predicts, chosen, go.size)
+            self.cache.put(key, predict)
         return predict
 
     @torch.no_grad()
-    def get_value_net_result(self, go, will_play_color):
-        """Get value network prediction"""
-        input_data = getAllFeatures(go, will_play_color)
-        input_data = torch.tensor(input_data).bool().reshape(1, -1, 19, 19).to(device)
-        value = self.value_net(input_data)[0].detach().cpu().item()
+    def get_value_net_result(self, go, will_play_color, symmetries=1):
+        """Get value network prediction, averaged over `symmetries` board symmetries in one batch"""
+        key = self.cache_key('value', go, will_play_color, symmetries)
+        value = self.cache.get(key)
+        if value is None:
+            chosen = self.pick_symmetries(symmetries)
+            input_data = self.symmetry_input_tensor(go, will_play_color, chosen)
+            value = self.value_net(input_data).detach().cpu().mean().item()
+            self.cache.put(key, value)
         return value
 
+    def cached_results(self, network, net, gos, will_play_colors):
+        """
+        Results of net for each position: cached ones come from the evaluation cache, the rest are
+        computed in one forward pass and cached (policy rows as tensors, values as floats)
+        """
+        keys = [self.cache_key(network, go, color) for go, color in zip(gos, will_play_colors)]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            input_data = self.input_tensor([gos[i] for i in missing], [will_play_colors[i] for i in missing])
+            outputs = net(input_data).detach().cpu()
+            for i, output in zip(missing, outputs):
+                # Copy the row so the cache does not keep the whole batch alive
+                result = output.item() if network == 'value' else output.clone()
+                self.cache.put(keys[i], result)
+                results[i] = result
+        return results
+
+    @torch.no_grad()
+    def get_policy_net_results(self, gos, will_play_colors):
+        """Policy network predictions for a list of positions in one forward pass, (N, size * size + 1)"""
+        return torch.stack(self.cached_results('policy', self.policy_net, gos, will_play_colors))
+
+    @torch.no_grad()
+    def get_playout_net_results(self, gos, will_play_colors):
+        """Playout network predictions for a list of positions in one forward pass, (N, size * size + 1)"""
+        return torch.stack(self.cached_results('playout', self.playout_net, gos, will_play_colors))
+
+    @torch.no_grad()
+    def get_value_net_results(self, gos, will_play_colors):
+        """Value network predictions for a list of positions in one forward pass, (N,)"""
+        return torch.tensor(self.cached_results('value', self.value_net, gos, will_play_colors))
+
     def get_value_result(self, go, will_play_color):
-        """Get simple value evaluation (based on piece count difference)"""
-        count_this_color = np.sum(go.board == will_play_color)
-        count_another_color = np.sum(go.board == -will_play_color)
-        return count_this_color - count_another_color
+        """Get simple value evaluation (area score difference including komi)"""
+        return go.score(self.komi) * will_play_color
+
+    def get_score_result(self, go, will_play_color):
+        """Get area scoring result on the value network's scale (1 win, 0 loss, 0.5 tie)"""
+        score = self.get_value_result(go, will_play_color)
+        return 0.5 if score == 0 else float(score > 0)
+
+    def get_score_results(self, gos, will_play_colors):
+        """get_score_result for a list of positions, scored together"""
+        scores = areaScores(np.stack([go.board for go in gos]), self.komi) * np.asarray(will_play_colors)
+        return torch.from_numpy(np.where(scores == 0, 0.5, (scores > 0).astype(np.float64)))
+
+    def get_mcts_value_function(self):
+        """Leaf evaluation function passed to MCTS"""
+        if self.value_source == 'score':
+            return self.get_score_result
+        return self.get_value_net_result
+
+    def get_mcts_value_batch_function(self):
+        """Batched leaf evaluation function passed to MCTS"""
+        if self.value_source == 'score':
+            return self.get_score_results
+        return self.get_value_net_results
 
     def gen_move_policy(self, go, will_play_color):
         """Generate move using policy network"""
-        predict = self.get_policy_net_result(go, will_play_color)
+        predict = self.get_policy_net_result(go, will_play_color, self.root_symmetries)
         predict_reverse_sort_index = reversed(torch.argsort(predict))
 
         # Output valueNet result to stderr
@@ -81,21 +327,21 @@ class Engine:
         # Output Candidate moves to stderr
         sys.stderr.write('Policy Candidate moves:\n')
         for predict_index in predict_reverse_sort_index[:5]:
-            x, y = toPosition(predict_index)
+            x, y = toPosition(predict_index, go.size)
             if (x, y) == (None, None):
                 sys.stderr.write('pass\n')
             else:
-                str_position = toStrPosition(x, y)
+                str_position = toStrPosition(x, y, go.size)
                 sys.stderr.write(f'{str_position} {predict[predict_index].item()}\n')
 
         # TODO: manually select a move
         for predict_index in predict_reverse_sort_index:
-            x, y = toPosition(predict_index)
+            x, y = toPosition(predict_index, go.size)
             if (x, y) == (None, None):
                 print('pass')
                 return None, None
             move_result = go.move(will_play_color, x, y)
-            str_position = toStrPosition(x, y)
+            str_position = toStrPosition(x, y, go.size)
 
             if move_result == False:
                 sys.stderr.write(f'Illegal move ({x}, {y}): {str_position}\n')
@@ -106,17 +352,25 @@ class Engine:
                 return x, y
 
     def gen_move_mcts(self, go, will_play_color, debug=False):
-        """Generate move using MCTS"""
-        root = MCTSNode(go, will_play_color, None)
+        """Generate move using MCTS, continuing from the subtree kept by the previous search"""
+        start = time.monotonic()
+        self.stop_pondering()
+        root = self.search_root_for(go, will_play_color)
+        self.search_root = root
 
         # TODO: manually select a move
-        best_next_node = MCTS(
-            root,
-            self.get_policy_net_result,
-            self.get_playout_net_result,
-            self.get_value_net_result,
-            debug=debug
-        )
+        think_time = self.time_control.think_time(will_play_color, len(go.record), go.size)
+        if think_time is None:
+            best_next_node = self.search(root, debug=debug)
+        else:
+            # Anytime search: the most visited move when the time budget runs out
+            sys.stderr.write(f'Thinking for {think_time:.1f}s\n')
+            best_next_node = self.search(root, max(self.max_visits - root.N, 1), debug,
+                                         deadline=start + think_time)
+        if best_next_node is not None:
+            # Root-parallel search merges the workers' results into a new tree
+            root = best_next_node.parent
+            self.search_root = root
 
         # Fallback to policy network if MCTS search fails
         if best_next_node is None:
@@ -125,41 +379,46 @@ class Engine:
             return self.gen_move_policy(go, will_play_color)
 
         # Check if there's a new move
-        if len(best_next_node.go.history) <= len(go.history):
+        if best_next_node.move is None:
             sys.stderr.write(
                 'MCTS search failed: no new moves, falling back to policy network\n')
             return self.gen_move_policy(go, will_play_color)
 
-        best_move = best_next_node.go.history[-1]
+        best_move = best_next_node.move
 
         if debug:
             playout_result = self.get_playout_net_result(go, will_play_color)
-            playout_move = toPosition(torch.argmax(playout_result))
+            playout_move = toPosition(torch.argmax(playout_result), go.size)
             print(playout_move, best_move, playout_move == best_move)
 
         # Output search results to stderr
         sys.stderr.write(f'MCTS search complete, candidate moves:\n')
-        for child in root.children:
+        # PUCT keeps every legal move as a child, so only list the visited ones
+        for child in sorted(root.children, key=lambda child: -child.N):
+            if child.N == 0:
+                break
             sys.stderr.write(str(child) + '\n')
+        sys.stderr.write(f'Evaluation cache: {self.cache.stats()}\n')
 
         x, y = best_move
         move_result = go.move(will_play_color, x, y)
-        str_position = toStrPosition(x, y)
+        str_position = toStrPosition(x, y, go.size)
 
         if move_result == False:
             sys.stderr.write(f'Illegal move ({x}, {y}): {str_position}\n')
-            # Fallback to policy network if move is illegal
-            go.board = root.go.board.copy()  # Restore board state
+            # Fallback to policy network if move is illegal (go is unchanged)
             return self.gen_move_policy(go, will_play_color)
         else:
             print(str_position)
+            # Keep only the subtree under the move played
+            self.search_root = reuseTree(root, go, -will_play_color)
         return x, y
 
 
 if __name__ == '__main__':
     # Test code
     engine = Engine()
-    go = Go()
+    go = engine.new_go()
     go.move(1, 3, 16)
     go.move(-1, 3, 3)
     go.move(1, 16, 16)
@@ -169,5 +428,5 @@ if __name__ == '__main__':
     debug = True
     engine.gen_move_mcts(go, -1, debug)
 
-    for item in go.history:
-        print(toStrPosition(item[0], item[1]))
+    for item in go.record.moves():
+        print(toStrPosition(item[0], item[1], go.size))
@@ -1,135 +1,502 @@
 import numpy as np
 import torch
 import sys
-from src.core.game import toPosition, toStrPosition
+import time
+import queue
+import threading
+import multiprocessing
+from src.core.game import toPosition, toStrPosition, convertGo
 
-class MCTSNode:
-    def __init__(self, go, willPlayColor, parent):
+
+class MCTSTree:
+    """
+    数组存储的搜索树（struct of arrays）
+    第 i 个节点的访问次数 N、价值之和 valueSum、先验概率 prior、到达它的落子 move（一维下标，根节点为 -1）、
+    轮到谁下 color、父节点 parent 和子节点区间 [firstChild, firstChild + childCount) 都存在预分配的
+    numpy 数组中，每个节点只占几十个字节。同一个节点的子节点在数组中是连续的一段，
+    选择子节点时对这一段做一次向量化的 argmax。
+    只有树本身保存根节点的局面 go，搜索时在它上面用 play_undoable 沿路径落子，结束后 undo 回根节点。
+    子节点只是数组中的一条记录，不保存局面，第一次访问时才在 go 上落子得到它的局面。
+    价值都是从根节点一方看的胜率（0 到 1）。
+    transpositions 为置换表（见 transposition），启用后不同走法到达的同一局面共用一段子节点，
+    树变成有向无环图，parent 只是第一次展开时的父节点，访问次数和价值沿搜索的路径回传。
+    """
+
+    def __init__(self, go, willPlayColor, capacity=1024):
         self.go = go.clone()
-        self.color = willPlayColor
-        self.parent = parent
-        self.children = []
-        self.N = 0  # visit count
-        self.Q = 0  # win rate
-        self.expanded = False
-        if parent:
-            self.parent.children.append(self)
+        self.size = go.size
+        self.N = np.zeros(capacity, dtype=np.int32)
+        self.valueSum = np.zeros(capacity, dtype=np.float64)
+        self.prior = np.zeros(capacity, dtype=np.float32)
+        self.move = np.full(capacity, -1, dtype=np.int16)
+        self.color = np.zeros(capacity, dtype=np.int8)
+        self.parent = np.full(capacity, -1, dtype=np.int32)
+        self.firstChild = np.zeros(capacity, dtype=np.int32)
+        self.childCount = np.zeros(capacity, dtype=np.int16)
+        self.count = 1
+        self.color[0] = willPlayColor
+        # 置换表：局面的键 -> 第一个展开并评估该局面的节点，None 为不使用
+        self.transpositions = None
 
-    def UCB(self):
-        if self.N == 0:
+    def reserve(self, count):
+        """保证还能再放 count 个节点，容量不够时翻倍"""
+        capacity = len(self.N)
+        if self.count + count <= capacity:
+            return
+        while capacity < self.count + count:
+            capacity *= 2
+        for name in ('N', 'valueSum', 'prior', 'move', 'color', 'parent', 'firstChild', 'childCount'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def addChildren(self, index, moves, priors=None):
+        """
+        给节点 index 添加一组子节点（moves 为一维下标），返回第一个子节点的下标
+        子节点要连续存放：已有子节点时，只能接在最后分配的节点后面
+        """
+        count = len(moves)
+        if self.childCount[index] and self.firstChild[index] + self.childCount[index] != self.count:
+            raise ValueError('children of a node must be added together')
+        self.reserve(count)
+        start = self.count
+        end = start + count
+        self.move[start:end] = moves
+        self.color[start:end] = -self.color[index]
+        self.parent[start:end] = index
+        if priors is not None:
+            self.prior[start:end] = priors
+        if not self.childCount[index]:
+            self.firstChild[index] = start
+        self.childCount[index] += count
+        self.count = end
+        return start
+
+    def childSlice(self, index):
+        start = self.firstChild[index]
+        return slice(start, start + self.childCount[index])
+
+    def UCB(self, index):
+        """单个节点的 UCB1 值，与 selectChild 的计算相同"""
+        if self.N[index] == 0:
             return float('inf')  # 未访问过的节点优先级最高
-        if self.parent is None or self.parent.N == 0:
+        parent = self.parent[index]
+        if parent < 0 or self.N[parent] == 0:
             return 0
-        return self.Q / self.N + np.sqrt(2 * np.log(self.parent.N) / self.N)
+        return self.valueSum[index] / self.N[index] + np.sqrt(2 * np.log(self.N[parent]) / self.N[index])
+
+    def selectChild(self, index):
+        """UCB1 最大的子节点（未访问过的优先，取第一个），没有子节点时返回 -1"""
+        children = self.childSlice(index)
+        if children.start == children.stop:
+            return -1
+        N = self.N[children]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ucb = self.valueSum[children] / N + np.sqrt(2 * np.log(max(self.N[index], 1)) / N)
+        ucb[N == 0] = np.inf
+        return children.start + int(np.argmax(ucb))
+
+    def selectChildPUCT(self, index, cPuct=1.5):
+        """
+        PUCT 最大的子节点：Q + cPuct * P * sqrt(N_parent) / (1 + N)
+        Q 为轮到下棋一方的胜率，未访问过的子节点取父节点的平均值；没有子节点时返回 -1
+        """
+        children = self.childSlice(index)
+        if children.start == children.stop:
+            return -1
+        N = self.N[children]
+        parentN = self.N[index]
+        parentQ = self.valueSum[index] / parentN if parentN else 0.5
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Q = np.where(N > 0, self.valueSum[children] / N, parentQ)
+        if self.color[index] != self.color[0]:
+            # 价值是根节点一方的胜率，对方选择时取 1 - Q
+            Q = 1 - Q
+        U = cPuct * self.prior[children] * np.sqrt(parentN) / (1 + N)
+        return children.start + int(np.argmax(Q + U))
+
+    def mostVisitedChild(self, index):
+        """访问次数最多的子节点，都没有访问过时返回 -1"""
+        children = self.childSlice(index)
+        if children.start == children.stop:
+            return -1
+        N = self.N[children]
+        best = int(np.argmax(N))
+        return children.start + best if N[best] > 0 else -1
+
+    def pathTo(self, index):
+        """沿 parent 从根节点到 index 的路径（没有置换表时就是搜索的路径）"""
+        path = []
+        while index >= 0:
+            path.append(index)
+            index = self.parent[index]
+        path.reverse()
+        return path
+
+    def applyVirtualLoss(self, path, amount, perspective=True):
+        """
+        给路径 path 上的节点临时加上 amount 次输棋的访问，让同一轮选出的叶节点分散到树的不同位置，
+        amount 为负数时撤销。perspective 为 True 时按选择这个节点的一方计算输棋
+        （价值是根节点一方的胜率，对方输即价值为 1），否则都记为价值 0
+        """
+        # 同一个节点只算一次（N[path] += 1 对重复的下标也只加一次）
+        path = np.unique(path)
+        self.N[path] += amount
+        if perspective:
+            self.valueSum[path[self.color[path] == self.color[0]]] += amount
+
+    def backup(self, path, value):
+        """路径 path 上的每个节点访问次数加一、价值加上 value"""
+        path = np.unique(path)
+        self.N[path] += 1
+        self.valueSum[path] += value
+
+    def reaches(self, first, count, target):
+        """从子节点区间 [first, first + count) 沿子节点能否到达节点 target（共用的区间只遍历一次）"""
+        seen = {int(first)}
+        frontier = np.arange(first, first + count)
+        while len(frontier):
+            if (frontier == target).any():
+                return True
+            frontier = frontier[self.childCount[frontier] > 0]
+            starts, unique = np.unique(self.firstChild[frontier], return_index=True)
+            counts = self.childCount[frontier][unique].astype(np.int64)
+            new = np.array([int(start) not in seen for start in starts], dtype=bool)
+            starts, counts = starts[new], counts[new]
+            seen.update(starts.tolist())
+            # 把各区间 [start, start + count) 拼成一个数组
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            frontier = np.repeat(starts, counts) + offsets
+        return False
+
+    def transposition(self, index, go):
+        """
+        置换表查询：节点 index（局面 go，还没有子节点）的局面已经被另一个节点评估过时，
+        让 index 共用那个节点的子节点，返回 (键, 那个节点的平均价值)，不需要再调用网络；
+        否则返回 (键, None)，评估后用 register 登记。
+        从共用的子节点能回到 index 时（打劫或提子后局面重复）不共用，保证树中不形成环
+        """
+        key = transpositionKey(go, int(self.color[index]))
+        owner = self.transpositions.get(key)
+        if owner is None or owner == index or self.N[owner] <= 0:
+            return key, None
+        count = self.childCount[owner]
+        first = self.firstChild[owner]
+        if count and self.reaches(first, count, index):
+            return key, None
+        self.firstChild[index] = first
+        self.childCount[index] = count
+        return key, self.valueSum[owner] / self.N[owner]
+
+    def register(self, key, index):
+        """在置换表中登记评估过的节点，同一局面只保留第一个"""
+        self.transpositions.setdefault(key, index)
+
+    def subtree(self, index, go):
+        """
+        把以节点 index 为根的子树复制成一棵新树（go 为节点 index 的局面），其余节点丢弃
+        节点按层重新编号，同一节点的子节点仍然连续存放；价值换算成新根节点一方的胜率
+        置换表中共用的一段子节点只复制一次，新树中仍然共用；置换表保留复制过来的节点
+        """
+        tree = MCTSTree(go, int(self.color[index]))
+        tree.N[0] = self.N[index]
+        tree.valueSum[0] = self.valueSum[index]
+        # 旧树的节点在新树中的下标，没有复制的为 -1
+        mapping = np.full(self.count, -1, dtype=np.int64)
+        mapping[index] = 0
+        # 旧树子节点区间的起点 -> 新树中的起点
+        blocks = {}
+        pending = [(index, 0)]
+        # 遍历时 pending 不断追加，只有展开过的节点才需要复制子节点
+        for old, new in pending:
+            children = self.childSlice(old)
+            if children.start in blocks:
+                tree.firstChild[new] = blocks[children.start]
+                tree.childCount[new] = self.childCount[old]
+                continue
+            start = tree.addChildren(new, self.move[children], self.prior[children])
+            end = tree.count
+            blocks[children.start] = start
+            mapping[children] = np.arange(start, end)
+            tree.N[start:end] = self.N[children]
+            tree.valueSum[start:end] = self.valueSum[children]
+            for offset in np.flatnonzero(self.childCount[children]):
+                pending.append((children.start + offset, start + offset))
+        if tree.color[0] != self.color[0]:
+            tree.valueSum[:tree.count] = tree.N[:tree.count] - tree.valueSum[:tree.count]
+        if self.transpositions is not None:
+            tree.transpositions = {key: int(mapping[owner]) for key, owner in self.transpositions.items()
+                                   if mapping[owner] >= 0}
+        return tree
+
+    def position(self, index):
+        """到达节点的落子 (x, y)，根节点为 None"""
+        move = int(self.move[index])
+        return None if move < 0 else toPosition(move, self.size)
+
+
+class MCTSNode:
+    """
+    搜索树节点：MCTSTree 中一个节点的视图 (tree, index)，属性都从树的数组中读取
+    MCTSNode(go, willPlayColor, None) 新建一棵以 go 为根的树，
+    MCTSNode(None, willPlayColor, parent, move) 给 parent 添加一个子节点。
+    """
+
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, go, willPlayColor, parent, move=None):
+        if parent is None:
+            self.tree = MCTSTree(go, willPlayColor)
+            self.index = 0
+        else:
+            self.tree = parent.tree
+            self.index = self.tree.addChildren(parent.index, [move[0] * self.tree.size + move[1]])
+
+    @classmethod
+    def at(cls, tree, index):
+        node = cls.__new__(cls)
+        node.tree = tree
+        node.index = index
+        return node
+
+    @property
+    def go(self):
+        return self.tree.go if self.index == 0 else None
+
+    @property
+    def size(self):
+        return self.tree.size
+
+    @property
+    def color(self):
+        return int(self.tree.color[self.index])
+
+    @property
+    def parent(self):
+        parent = int(self.tree.parent[self.index])
+        return MCTSNode.at(self.tree, parent) if parent >= 0 else None
+
+    @property
+    def move(self):
+        return self.tree.position(self.index)
+
+    @property
+    def children(self):
+        children = self.tree.childSlice(self.index)
+        return [MCTSNode.at(self.tree, child) for child in range(children.start, children.stop)]
+
+    @property
+    def N(self):
+        return int(self.tree.N[self.index])
+
+    @property
+    def Q(self):
+        return float(self.tree.valueSum[self.index])
+
+    @property
+    def expanded(self):
+        return self.tree.N[self.index] > 0
+
+    def UCB(self):
+        return self.tree.UCB(self.index)
+
+    def __eq__(self, other):
+        return isinstance(other, MCTSNode) and self.tree is other.tree and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
 
     def __str__(self):
-        if len(self.go.history) == 0:
+        if self.move is None:
             strPosition = "root"
         else:
-            x, y = self.go.history[-1]
-            strPosition = toStrPosition(x, y)
+            x, y = self.move
+            strPosition = toStrPosition(x, y, self.size)
         result = f'{self.color} {self.N} {self.Q:.3f} {self.UCB():.3f} {strPosition}'
         return result
 
 
 def getBestChild(node):
     """选取UCB最大的节点"""
-    bestChild = None
-    bestUCB = float('-inf')
-    for child in node.children:
-        ucb = child.UCB()
-        if ucb > bestUCB:
-            bestChild = child
-            bestUCB = ucb
-    return bestChild
+    child = node.tree.selectChild(node.index)
+    return MCTSNode.at(node.tree, child) if child >= 0 else None
 
 
 def getMostVisitedChild(node):
     """获取访问次数最多的子节点"""
-    bestChild = None
-    bestN = 0
-    for child in node.children:
-        if child.N > bestN:
-            bestChild = child
-            bestN = child.N
-    return bestChild
+    child = node.tree.mostVisitedChild(node.index)
+    return MCTSNode.at(node.tree, child) if child >= 0 else None
 
 
-def searchChildren(node, getPolicyNetResult):
-    """为节点搜索子节点"""
-    go = node.go
-    nodeWillPlayColor = node.color
+def searchChildren(node, go, getPolicyNetResult, symmetries=1, candidates=5):
+    """
+    为节点搜索子节点，go 为该节点的局面，symmetries > 1 时策略网络取多个对称变换的平均
+    按策略网络的概率保留最多 candidates 个合法落子（None 为全部），并记录它们在合法落子中的先验概率
+    子节点只是树中的记录，不创建局面
+    """
+    predict = policyResult(getPolicyNetResult, go, node.color, symmetries)
+    expandChildren(node, go, predict, candidates)
+
 
-    predict = getPolicyNetResult(go, nodeWillPlayColor)
-    predictReverseSortIndex = reversed(torch.argsort(predict))
+def policyResult(getPolicyNetResult, go, willPlayColor, symmetries=1):
+    """策略网络的输出，symmetries > 1 时取多个对称变换的平均"""
+    if symmetries > 1:
+        return getPolicyNetResult(go, willPlayColor, symmetries=symmetries)
+    return getPolicyNetResult(go, willPlayColor)
 
-    count = 0
-    nextColor = -nodeWillPlayColor
+
+def childCandidates(go, willPlayColor, predict, candidates=5):
+    """按策略网络的输出 predict 选出子节点的落子和先验概率 (moves, priors)，还不加入树中"""
+    legal = go.legal_moves_mask(willPlayColor)
+    legal[-1] = False
 
     # 移除pass的检查，确保至少创建一些子节点
-    for predictIndex in predictReverseSortIndex:
-        x, y = toPosition(predictIndex)
-        if (x, y) == (None, None):
-            continue
-        newGo = go.clone()
+    # 概率最高的 candidates 个合法落子，同分时下标大的优先
+    order = torch.argsort(predict).numpy()[::-1]
+    moves = order[legal[order]][:candidates]
+    priors = torch.softmax(predict.double(), dim=0).numpy()[moves]
+    return moves, priors / priors.sum() if len(moves) else priors
 
-        if newGo.move(nodeWillPlayColor, x, y):
-            newNode = MCTSNode(newGo, nextColor, node)
-            count += 1
-            if count >= 5:  # 增加候选子节点数量
-                break
+
+def attachChildren(node, children):
+    """把 childCandidates 选出的子节点加入树中"""
+    moves, priors = children
+    if len(moves):
+        node.tree.addChildren(node.index, moves, priors)
+
+
+def expandChildren(node, go, predict, candidates=5):
+    """按策略网络的输出 predict 给节点添加子节点，见 searchChildren"""
+    attachChildren(node, childCandidates(go, node.color, predict, candidates))
 
 
-def treePolicy(root):
+def reuseTree(root, go, willPlayColor):
     """
-    传入当前开始搜索的节点，返回创建的新的节点
-    先找当前未选择过的子节点，如果有多个则随机选。如果都选择过就找UCB最大的节点
+    复用上一次搜索的树：root 为树的根节点，go 为 root 的局面之后又下了若干手的局面，
+    沿这些落子找到对应的节点，把它提升为新的根节点并丢弃树的其余部分
+    棋谱对不上、树中没有这些落子或轮到的一方不同时返回 None
     """
-    node = root
-    while True:
-        if len(node.children) == 0:
-            return node
+    tree = root.tree
+    record = go.record
+    steps = len(record) - len(tree.go.record)
+    if steps < 0:
+        return None
+    moves = []
+    for _ in range(steps):
+        moves.append(record.move)
+        record = record.previous
+    if record is not tree.go.record:
+        return None
+
+    index = 0
+    position = tree.go.clone()
+    for x, y in reversed(moves):
+        children = tree.childSlice(index)
+        found = np.flatnonzero(tree.move[children] == x * tree.size + y)
+        if not len(found):
+            return None
+        position.move(int(tree.color[index]), x, y)
+        index = children.start + int(found[0])
+    # pass 不记入棋谱，落子的一方可能和树中的不同，用哈希确认是同一个局面
+    if tree.color[index] != willPlayColor or position.hash != go.hash:
+        return None
+    if index == 0:
+        return root
+    return MCTSNode.at(tree.subtree(index, go), 0)
+
 
-        # 寻找未访问的子节点
-        unvisited = [child for child in node.children if child.N == 0]
-        if unvisited:
-            return unvisited[0]  # 返回第一个未访问的节点
+def transpositionKey(go, willPlayColor):
+    """
+    置换表的键：局面哈希加上轮到谁下，再加上打劫禁着点（上上手的落子点被提空时），
+    保证同一个键的局面合法落子也相同
+    """
+    x, y = go.history[-2]
+    ko = x * go.size + y if x is not None and go.board[x, y] == 0 else -1
+    return go.hashKey(willPlayColor), ko
+
+
+def treePolicy(root, go, selection='ucb1', cPuct=1.5, path=None):
+    """
+    传入当前开始搜索的节点和它的局面，返回创建的新的节点
+    selection 为 'ucb1' 时选择 UCB 最大的子节点（未访问过的子节点优先，取第一个），
+    为 'puct' 时选择 PUCT 最大的子节点；到达未访问的节点或叶节点时停止
+    沿途的落子用 play_undoable 下在 go 上，返回时 go 为所选节点的局面
+    path 不为 None 时在其中依次记下经过的节点（包括开始的节点和返回的节点）
+    """
+    tree = root.tree
+    index = root.index
+    if path is not None:
+        path.append(index)
+    while True:
+        if selection == 'puct':
+            child = tree.selectChildPUCT(index, cPuct)
         else:
-            node = getBestChild(node)
-            if node is None:  # 防止无限循环
-                return root
+            child = tree.selectChild(index)
+        if child < 0:
+            return MCTSNode.at(tree, index)
+        go.play_undoable(int(tree.color[index]), *tree.position(child))
+        if path is not None:
+            path.append(child)
+        if tree.N[child] == 0:
+            return MCTSNode.at(tree, child)  # 返回第一个未访问的节点
+        index = child
+
+
+def backward(node, value, path=None):
+    """反向传播MCTS搜索结果，path 为搜索的路径（没有给出时沿 parent 回到根节点）"""
+    tree = node.tree
+    tree.backup(path if path is not None else tree.pathTo(node.index), value)
+
 
+# 默认每个叶节点模拟的步数，0 为不模拟、直接用价值网络评估叶节点
+ROLLOUT_DEPTH = 5
 
-def backward(node, value):
-    """反向传播MCTS搜索结果"""
-    while node:
-        node.N += 1
-        node.Q += value
-        node.expanded = True
-        node = node.parent
 
+def sampleMoves(predicts, masks):
+    """
+    按快速策略网络的输出 predicts（(N, size * size + 1) 的对数概率）在合法落子 masks 中随机选择，
+    所有局面一次向量化抽样，返回每个局面选中的一维下标（size * size 为 pass）
+    """
+    predicts = np.asarray(predicts, dtype=np.float64)
+    probability = np.exp(predicts - predicts.max(axis=1, keepdims=True)) * masks
+    total = probability.sum(axis=1)
+    # 合法落子的概率都下溢为 0 时在合法落子中均匀选择
+    empty = total <= 0
+    if empty.any():
+        probability[empty] = masks[empty]
+        total[empty] = probability[empty].sum(axis=1)
+    cumulative = np.cumsum(probability, axis=1)
+    threshold = np.random.random(len(probability)) * total
+    digits = (cumulative <= threshold[:, None]).sum(axis=1)
+    return np.minimum(digits, probability.shape[1] - 1)
 
-def defaultPolicy(expandNode, rootColor, getPlayoutNetResult, getValueNetResult, debug=False):
-    """随机操作后创建新的节点，返回最终节点的value"""
-    newGo = expandNode.go.clone()
+
+def defaultPolicy(expandNode, go, rootColor, getPlayoutNetResult, getValueNetResult, debug=False,
+                  depth=ROLLOUT_DEPTH, stop=None):
+    """
+    从 go（expandNode 的局面）随机落子 depth 步，返回最终局面的value，落子可以 undo
+    每次调用网络前检查 stop，返回 True 时放弃模拟并返回 None
+    """
+    newGo = go
     willPlayColor = expandNode.color
 
-    for i in range(5):
+    for i in range(depth):
+        if stop is not None and stop():
+            return None
         predict = getPlayoutNetResult(newGo, willPlayColor)
 
-        attempts = 0
-        while attempts < 20:  # 防止无限循环
-            # random choose a move
-            selectedIndex = np.random.choice(len(predict), p=predict.exp().detach().numpy())
-            x, y = toPosition(selectedIndex)
-            if (x, y) == (None, None):
-                break  # pass move
-            if newGo.move(willPlayColor, x, y):
-                break
-            attempts += 1
+        # 只在合法的落子中按概率随机选择（pass 总是合法）
+        mask = newGo.legal_moves_mask(willPlayColor)
+        selectedIndex = sampleMoves(predict.double().numpy()[None], mask[None])[0]
+        x, y = toPosition(selectedIndex, newGo.size)
+        if (x, y) != (None, None):
+            newGo.play_undoable(willPlayColor, x, y)
 
         willPlayColor = -willPlayColor
 
+    if stop is not None and stop():
+        return None
     value = getValueNetResult(newGo, rootColor)
 
     if debug:
@@ -138,17 +505,442 @@ def defaultPolicy(expandNode, rootColor, getPlayoutNetResult, getValueNetResult,
     return value
 
 
-def MCTS(root, getPolicyNetResult, getPlayoutNetResult, getValueNetResult, iterations=200, debug=False):
-    """执行MCTS搜索"""
+# 搜索时选择子节点的方式
+SELECTION_MODES = ('ucb1', 'puct')
+
+
+def defaultPolicyBatch(gos, colors, rootColor, getPlayoutNetResults, getValueNetResults, depth=ROLLOUT_DEPTH,
+                       stop=None):
+    """
+    defaultPolicy 的批量版本：gos 为各叶节点局面的副本，colors 为轮到谁下，所有局面同步模拟 depth 步，
+    每一步一起调用一次快速策略网络、一次向量化抽样，最后一起调用一次价值网络，返回各局面的 value
+    每次调用网络前检查 stop，返回 True 时放弃模拟并返回 None
+    """
+    colors = np.asarray(colors)
+    for i in range(depth):
+        if stop is not None and stop():
+            return None
+        predicts = getPlayoutNetResults(gos, colors.tolist()).double().numpy()
+        # 只在合法的落子中按概率随机选择（pass 总是合法）
+        masks = np.stack([go.legal_moves_mask(int(color)) for go, color in zip(gos, colors)])
+        for go, color, digit in zip(gos, colors, sampleMoves(predicts, masks)):
+            x, y = toPosition(digit, go.size)
+            if (x, y) != (None, None):
+                go.move(int(color), x, y)
+        colors = -colors
+
+    if stop is not None and stop():
+        return None
+    return [float(value) for value in getValueNetResults(gos, [rootColor] * len(gos))]
+
+
+def batchFunction(function):
+    """把单个局面的网络调用包装成批量调用（逐个计算后叠在一起）"""
+    def batch(gos, colors):
+        return torch.stack([torch.as_tensor(function(go, color)) for go, color in zip(gos, colors)])
+    return batch
+
+
+def collectLeaves(root, go, count, selection, cPuct, virtualLoss, perspective, busy=()):
+    """
+    用虚拟损失选出最多 count 个不同的叶节点并复制它们的局面，busy 为其他线程正在评估的叶节点
+    选到重复的叶节点时（虚拟损失也没能把选择分散开，例如树中只有根节点）就到此为止
+    置换表命中的叶节点不需要评估，选出时直接回传
+    返回 (叶节点, 路径, 置换表的键, 局面副本, 命中置换表的次数)
+    """
+    tree = root.tree
+    leaves = []
+    paths = []
+    keys = []
+    leafGos = []
+    hits = 0
+    for k in range(count):
+        mark = len(go.undoStack)
+        path = []
+        leaf = treePolicy(root, go, selection, cPuct, path)
+        if leaf.index in leaves or leaf.index in busy:
+            while len(go.undoStack) > mark:
+                go.undo()
+            break
+        key = value = None
+        if tree.transpositions is not None:
+            key, value = tree.transposition(leaf.index, go)
+        if value is not None:
+            tree.backup(path, value)
+            hits += 1
+        else:
+            leaves.append(leaf.index)
+            paths.append(path)
+            keys.append(key)
+            leafGos.append(go.clone())
+            tree.applyVirtualLoss(path, virtualLoss, perspective)
+        while len(go.undoStack) > mark:
+            go.undo()
+    return leaves, paths, keys, leafGos, hits
+
+
+def evaluateLeaves(tree, leaves, leafGos, rootColor, getPolicyNetResult, getPolicyNetResults, getPlayoutNetResults,
+                   getValueNetResults, rootSymmetries, candidates, rolloutDepth, stop=None):
+    """
+    对 collectLeaves 选出的一批叶节点调用网络，不修改树：
+    根节点可能使用多个对称变换，其余叶节点一起计算策略网络，再一起模拟和估值
+    返回 (每个叶节点的 childCandidates, 每个叶节点的 value)；每次调用网络前检查 stop，返回 True 时返回 None
+    """
+    colors = [int(tree.color[leaf]) for leaf in leaves]
+    batch = [i for i, leaf in enumerate(leaves) if not (leaf == 0 and rootSymmetries > 1)]
+    children = [None] * len(leaves)
+    if batch:
+        if stop is not None and stop():
+            return None
+        predicts = getPolicyNetResults([leafGos[i] for i in batch], [colors[i] for i in batch])
+        for i, predict in zip(batch, predicts):
+            children[i] = childCandidates(leafGos[i], colors[i], predict, candidates)
+    if len(batch) < len(leaves):
+        if stop is not None and stop():
+            return None
+        i = leaves.index(0)
+        predict = policyResult(getPolicyNetResult, leafGos[i], colors[i], rootSymmetries)
+        children[i] = childCandidates(leafGos[i], colors[i], predict, candidates)
+
+    values = defaultPolicyBatch(leafGos, colors, rootColor, getPlayoutNetResults, getValueNetResults,
+                                rolloutDepth, stop)
+    return None if values is None else (children, values)
+
+
+def finishLeaves(tree, leaves, paths, keys, results, virtualLoss, perspective, debug=False):
+    """
+    撤销一批叶节点的虚拟损失；results 为 evaluateLeaves 的结果时展开叶节点、回传价值并登记置换表，
+    为 None（停止时）只撤销虚拟损失，叶节点保持未展开
+    """
+    for path in paths:
+        tree.applyVirtualLoss(path, -virtualLoss, perspective)
+    if results is None:
+        return
+    for leaf, path, key, children, value in zip(leaves, paths, keys, *results):
+        attachChildren(MCTSNode.at(tree, leaf), children)
+        tree.backup(path, value)
+        if key is not None:
+            tree.register(key, leaf)
+        if debug:
+            print(f'expandNode: {MCTSNode.at(tree, leaf)} value: {value}')
+
+
+def searchBatched(root, go, getPolicyNetResult, getPolicyNetResults, getPlayoutNetResults, getValueNetResults,
+                  iterations, batchSize, rootSymmetries, selection, candidates, cPuct, virtualLoss, debug,
+                  stop=None, rolloutDepth=ROLLOUT_DEPTH):
+    """
+    每一轮用虚拟损失选出最多 batchSize 个不同的叶节点（collectLeaves），
+    展开、模拟和估值都对这一批局面各调用一次网络，最后撤销虚拟损失、展开叶节点并回传结果
+    每一轮开始前和每次调用网络前检查 stop，返回 True 时放弃这一轮并结束：
+    撤销虚拟损失，还没有评估完的叶节点不展开，树中不会留下半轮的结果
+    """
+    tree = root.tree
+    rootColor = root.color
+    perspective = selection == 'puct'
+    evaluated = 0
+    while evaluated < iterations:
+        if stop is not None and stop():
+            break
+        leaves, paths, keys, leafGos, hits = collectLeaves(root, go, min(batchSize, iterations - evaluated),
+                                                           selection, cPuct, virtualLoss, perspective)
+        evaluated += hits
+        if not leaves:
+            continue
+        results = evaluateLeaves(tree, leaves, leafGos, rootColor, getPolicyNetResult, getPolicyNetResults,
+                                 getPlayoutNetResults, getValueNetResults, rootSymmetries, candidates,
+                                 rolloutDepth, stop)
+        finishLeaves(tree, leaves, paths, keys, results, virtualLoss, perspective, debug)
+        if results is None:
+            break
+        evaluated += len(leaves)
+
+
+class InferenceQueue:
+    """
+    多个搜索线程共用的推理队列：线程调用 batch(function) 包装出的函数提交局面后等待结果，
+    后台线程把同一时间到达的请求按网络函数合并，每个函数只调用一次批量版本，再把结果分给各线程
+    所有网络调用都在这个后台线程中进行，网络函数共用的输入缓冲区不会被同时写入
+    """
+
+    def __init__(self, maxBatch=16, wait=0.001):
+        self.maxBatch = maxBatch
+        self.wait = wait
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def batch(self, function):
+        """批量网络函数 function(gos, colors) 的排队版本"""
+        def call(gos, colors):
+            # [函数, 局面, 轮到谁下, 完成事件, 结果]
+            request = [function, gos, colors, threading.Event(), None]
+            self.requests.put(request)
+            request[3].wait()
+            if isinstance(request[4], Exception):
+                raise request[4]
+            return request[4]
+        return call
+
+    def run(self):
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            requests = [request]
+            count = len(request[1])
+            # 再等一小会儿，收集其他线程同时提交的请求
+            while count < self.maxBatch:
+                try:
+                    request = self.requests.get(timeout=self.wait)
+                except queue.Empty:
+                    break
+                if request is None:
+                    # 处理完这一批再结束
+                    self.requests.put(None)
+                    break
+                requests.append(request)
+                count += len(request[1])
+
+            groups = {}
+            for request in requests:
+                groups.setdefault(request[0], []).append(request)
+            for function, group in groups.items():
+                try:
+                    results = function([go for request in group for go in request[1]],
+                                       [color for request in group for color in request[2]])
+                except Exception as error:
+                    results = error
+                start = 0
+                for request in group:
+                    end = start + len(request[1])
+                    request[4] = results if isinstance(results, Exception) else results[start:end]
+                    request[3].set()
+                    start = end
+
+    def close(self):
+        self.requests.put(None)
+        self.thread.join()
+
+
+def searchThreaded(root, go, getPolicyNetResult, getPolicyNetResults, getPlayoutNetResults, getValueNetResults,
+                   iterations, threads, batchSize, rootSymmetries, selection, candidates, cPuct, virtualLoss, debug,
+                   stop=None, rolloutDepth=ROLLOUT_DEPTH):
+    """
+    树并行：threads 个线程共用一棵树，每个线程在锁内用虚拟损失选出最多 batchSize 个叶节点（collectLeaves），
+    在锁外评估；网络调用通过 InferenceQueue 把各线程的叶节点合并成最多 threads * batchSize 个局面的一批
+    选中其他线程正在评估的叶节点时这一批到此为止，一个也没有选出时稍等再重新选择
+    每次调用网络前检查 stop，返回 True 时放弃正在评估的叶节点（撤销虚拟损失，不展开）
+    """
+    tree = root.tree
+    rootColor = root.color
+    perspective = selection == 'puct'
+    lock = threading.Lock()
+    pending = set()
+    started = [0]
+    errors = []
+    inference = InferenceQueue(threads * batchSize)
+    policy = inference.batch(getPolicyNetResults)
+    playout = inference.batch(getPlayoutNetResults)
+    value = inference.batch(getValueNetResults)
+    rootPolicy = inference.batch(
+        lambda gos, colors: getPolicyNetResult(gos[0], colors[0], symmetries=rootSymmetries)[None])
+
+    def rootPolicyResult(leafGo, color, symmetries):
+        return rootPolicy([leafGo], [color])[0]
+
+    def worker():
+        # 每个线程在自己的局面副本上沿路径落子
+        position = go.clone()
+        try:
+            while True:
+                with lock:
+                    if started[0] >= iterations or errors or (stop is not None and stop()):
+                        return
+                    leaves, paths, keys, leafGos, hits = collectLeaves(
+                        root, position, min(batchSize, iterations - started[0]), selection, cPuct, virtualLoss,
+                        perspective, pending)
+                    pending.update(leaves)
+                    started[0] += hits + len(leaves)
+                if not leaves:
+                    if not hits:
+                        time.sleep(0.0005)
+                    continue
+                results = None
+                try:
+                    results = evaluateLeaves(tree, leaves, leafGos, rootColor, rootPolicyResult, policy, playout,
+                                             value, rootSymmetries, candidates, rolloutDepth, stop)
+                finally:
+                    with lock:
+                        finishLeaves(tree, leaves, paths, keys, results, virtualLoss, perspective, debug)
+                        pending.difference_update(leaves)
+        except Exception as error:
+            errors.append(error)
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    inference.close()
+    if errors:
+        raise errors[0]
+
+
+def MCTS(root, getPolicyNetResult, getPlayoutNetResult, getValueNetResult, iterations=200, debug=False,
+         backend=None, rootSymmetries=1, selection='ucb1', candidates=None, cPuct=1.5,
+         batchSize=1, getPolicyNetResults=None, getPlayoutNetResults=None, getValueNetResults=None,
+         virtualLoss=1, stop=None, threads=1, transpositions=False, rolloutDepth=ROLLOUT_DEPTH):
+    """
+    执行MCTS搜索，backend 不为 None 时先把根节点的局面转换为该棋盘实现
+    rootSymmetries 为展开根节点时策略网络使用的对称变换数，其余节点只用原局面
+    selection 为 'ucb1' 或 'puct'，candidates 为每个节点保留的候选落子数，
+    None 时 ucb1 为 5 个，puct 为全部合法落子（按先验概率分配访问）
+    batchSize > 1 时每轮用虚拟损失（virtualLoss）收集多个叶节点，批量调用网络：
+    get*NetResults(gos, colors) 为对应网络的批量版本，没有给出时逐个调用单个局面的版本
+    stop 为可选的函数，每次迭代开始和每次调用网络前调用，返回 True 时放弃正在进行的迭代并结束搜索
+    （用于后台思考和限时搜索），树中只保留已经完成的迭代
+    threads > 1 时用 threads 个线程树并行搜索（见 searchThreaded），每个线程每次评估最多 batchSize 个叶节点
+    transpositions 为 True 时使用置换表，不同走法到达的同一局面共用评估结果和子节点
+    rolloutDepth 为每个叶节点用快速策略网络模拟的步数，0 时不模拟，只用价值网络评估叶节点
+    """
+    if selection not in SELECTION_MODES:
+        raise ValueError(f'unknown selection mode: {selection}')
+    if candidates is None and selection == 'ucb1':
+        candidates = 5
+    tree = root.tree
+    if backend is not None:
+        tree.go = convertGo(tree.go, backend)
     rootColor = root.color
+    go = tree.go
+    if transpositions and tree.transpositions is None:
+        tree.transpositions = {}
+    if threads > 1:
+        searchThreaded(root, go, getPolicyNetResult,
+                       getPolicyNetResults or batchFunction(getPolicyNetResult),
+                       getPlayoutNetResults or batchFunction(getPlayoutNetResult),
+                       getValueNetResults or batchFunction(getValueNetResult),
+                       iterations, threads, batchSize, rootSymmetries, selection, candidates, cPuct, virtualLoss,
+                       debug, stop, rolloutDepth)
+        return getMostVisitedChild(root)
+    if batchSize > 1:
+        searchBatched(root, go, getPolicyNetResult,
+                      getPolicyNetResults or batchFunction(getPolicyNetResult),
+                      getPlayoutNetResults or batchFunction(getPlayoutNetResult),
+                      getValueNetResults or batchFunction(getValueNetResult),
+                      iterations, batchSize, rootSymmetries, selection, candidates, cPuct, virtualLoss, debug,
+                      stop, rolloutDepth)
+        return getMostVisitedChild(root)
+
     for i in range(iterations):
-        expandNode = treePolicy(root)
+        if stop is not None and stop():
+            break
+        mark = len(go.undoStack)
+        path = []
+        expandNode = treePolicy(root, go, selection, cPuct, path)
         if expandNode is None:
             break
-        searchChildren(expandNode, getPolicyNetResult)
-        value = defaultPolicy(expandNode, rootColor, getPlayoutNetResult, getValueNetResult, debug)
-        backward(expandNode, value)
+        key = value = None
+        if tree.transpositions is not None:
+            # 置换表命中时共用已有的子节点和价值，不调用网络
+            key, value = tree.transposition(expandNode.index, go)
+        if value is None:
+            predict = policyResult(getPolicyNetResult, go, expandNode.color,
+                                   rootSymmetries if expandNode == root else 1)
+            children = childCandidates(go, expandNode.color, predict, candidates)
+            value = defaultPolicy(expandNode, go, rootColor, getPlayoutNetResult, getValueNetResult, debug,
+                                  rolloutDepth, stop)
+            if value is None:
+                # 停止：放弃这次迭代，回到根节点的局面
+                while len(go.undoStack) > mark:
+                    go.undo()
+                break
+            attachChildren(expandNode, children)
+            if key is not None:
+                tree.register(key, expandNode.index)
+        backward(expandNode, value, path)
+        # 回到根节点的局面
+        while len(go.undoStack) > mark:
+            go.undo()
 
     # 选择访问次数最多的子节点，而不是UCB最大的
     bestNextNode = getMostVisitedChild(root)
-    return bestNextNode 
\ No newline at end of file
+    return bestNextNode
+
+
+def rootWorker(root, search, iterations, stop, seed, results):
+    """根并行的工作进程：在 root 的副本上搜索，传回根节点子节点的统计"""
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    # 每个进程只用一个核，进程数即使用的核数
+    torch.set_num_threads(1)
+    search(root, iterations, stop=stop)
+    tree = root.tree
+    children = tree.childSlice(0)
+    results.put((tree.move[children], tree.N[children], tree.valueSum[children], tree.prior[children],
+                 int(tree.N[0]), float(tree.valueSum[0])))
+
+
+# 并行搜索的方式：'tree' 为多线程共用一棵树，'root' 为多进程各自搜索后合并根节点
+PARALLEL_MODES = ('tree', 'root')
+
+
+def rootParallelSupported():
+    """根并行需要用 fork 启动进程（Windows 不支持）"""
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+def MCTSRootParallel(root, search, processes, iterations=200, stop=None):
+    """
+    根并行：fork 出 processes 个进程，各自在 root 所在树的一份副本上调用 search(root, iterations, stop=stop)，
+    把各进程根节点的子节点按落子合并（访问次数和价值相加），返回合并后只有一层的新树中访问次数最多的子节点
+    root 已有的访问只计算一次；进程之间只传回根节点的统计，需要支持 fork 的平台
+    stop 在各进程中分别调用，只能依赖时间等不需要进程间通信的条件
+    """
+    if not rootParallelSupported():
+        raise RuntimeError('root-parallel search needs the fork start method, which this platform lacks; '
+                           'use tree-parallel search instead')
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    seeds = np.random.randint(2 ** 31, size=processes)
+    workers = [context.Process(target=rootWorker, args=(root, search, iterations, stop, int(seed), results), daemon=True)
+               for seed in seeds]
+    for worker in workers:
+        worker.start()
+    stats = []
+    while len(stats) < processes:
+        try:
+            stats.append(results.get(timeout=0.1))
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in workers) and results.empty():
+                raise RuntimeError('root-parallel search worker exited without a result')
+    for worker in workers:
+        worker.join()
+
+    tree = root.tree
+    area = tree.size * tree.size
+    N = np.zeros(area, dtype=np.int64)
+    valueSum = np.zeros(area)
+    prior = np.zeros(area)
+    present = np.zeros(area, dtype=bool)
+    rootN = -(processes - 1) * int(tree.N[0])
+    rootValue = -(processes - 1) * float(tree.valueSum[0])
+    # 每个进程都从 root 已有的统计开始，多算的部分减掉
+    children = tree.childSlice(0)
+    np.add.at(N, tree.move[children], -(processes - 1) * tree.N[children].astype(np.int64))
+    np.add.at(valueSum, tree.move[children], -(processes - 1) * tree.valueSum[children])
+    for moves, childN, childValue, childPrior, workerN, workerValue in stats:
+        np.add.at(N, moves, childN)
+        np.add.at(valueSum, moves, childValue)
+        prior[moves] = childPrior
+        present[moves] = True
+        rootN += workerN
+        rootValue += workerValue
+
+    moves = np.flatnonzero(present)
+    merged = MCTSTree(tree.go, root.color)
+    merged.addChildren(0, moves, prior[moves])
+    merged.N[1:merged.count] = N[moves]
+    merged.valueSum[1:merged.count] = valueSum[moves]
+    merged.N[0] = rootN
+    merged.valueSum[0] = rootValue
+    return getMostVisitedChild(MCTSNode.at(merged, 0))
@@ -3,6 +3,13 @@ import torch.nn as nn
 import torch.nn.functional as F
 from src.core.game import *
 
+def model_file_name(name, board_size=19):
+    """Model file name for a board size, e.g. policyNet.pt (19x19) or policyNet_9x9.pt"""
+    if board_size == 19:
+        return f'{name}.pt'
+    return f'{name}_{board_size}x{board_size}.pt'
+
+
 class ResBlock(nn.Module):
     def __init__(self, channels):
         super(ResBlock, self).__init__()
@@ -21,8 +28,9 @@ class ResBlock(nn.Module):
 
 # 策略网络 - ResNet structure with increased parameters
 class PolicyNetwork(nn.Module):
-    def __init__(self):
+    def __init__(self, board_size=19):
         super(PolicyNetwork, self).__init__()
+        self.board_size = board_size
         self.conv_in = nn.Conv2d(15, 128, 3, padding=1)
         self.bn_in = nn.BatchNorm2d(128)
 
@@ -48,14 +56,16 @@ class PolicyNetwork(nn.Module):
         # Policy head
         x = F.relu(self.bn_policy(self.conv_policy(x)))
         x = self.conv_final(x)
-        x = x.view(-1, 19 * 19)
-        x = torch.cat((x * blank.view(-1, 19 * 19), torch.ones((len(x), 1)).to(x.device) * 1e-50), dim=1)
+        area = self.board_size * self.board_size
+        x = x.view(-1, area)
+        x = torch.cat((x * blank.view(-1, area), torch.ones((len(x), 1)).to(x.device) * 1e-50), dim=1)
         return x
 
 # 快速策略网络 - ResNet structure but lighter than PolicyNetwork
 class PlayoutNetwork(nn.Module):
-    def __init__(self):
+    def __init__(self, board_size=19):
         super(PlayoutNetwork, self).__init__()
+        self.board_size = board_size
         self.conv_in = nn.Conv2d(15, 64, 3, padding=1)
         self.bn_in = nn.BatchNorm2d(64)
 
@@ -64,7 +74,7 @@ class PlayoutNetwork(nn.Module):
         
         # Policy head (similar to original)
         self.conv_final = nn.Conv2d(64, 1, 1)
-        self.linear = nn.Linear(19 * 19, 19 * 19 + 1)
+        self.linear = nn.Linear(board_size * board_size, board_size * board_size + 1)
 
     def forward(self, x):
         blank = x[:, 0]
@@ -79,16 +89,18 @@ class PlayoutNetwork(nn.Module):
             
         # Final convolution and linear layer
         x = self.conv_final(x)
-        x = x.view(-1, 19 * 19)
+        area = self.board_size * self.board_size
+        x = x.view(-1, area)
         x = self.linear(x)
-        x = torch.cat((x[:, :-1] * blank.view(-1, 19 * 19), x[:, -1:]), dim=1)
+        x = torch.cat((x[:, :-1] * blank.view(-1, area), x[:, -1:]), dim=1)
         x = F.log_softmax(x, dim=1)
         return x
 
 # 价值网络 - ResNet structure
 class ValueNetwork(nn.Module):
-    def __init__(self):
+    def __init__(self, board_size=19):
         super(ValueNetwork, self).__init__()
+        self.board_size = board_size
         self.conv_in = nn.Conv2d(15, 64, 3, padding=1)
         self.bn_in = nn.BatchNorm2d(64)
         
@@ -99,7 +111,7 @@ class ValueNetwork(nn.Module):
         self.conv_value = nn.Conv2d(64, 32, 1)
         self.bn_value = nn.BatchNorm2d(32)
         self.conv_final = nn.Conv2d(32, 2, 1)
-        self.linear = nn.Linear(2 * 19 * 19, 256)
+        self.linear = nn.Linear(2 * board_size * board_size, 256)
         self.linear_final = nn.Linear(256, 1)
 
     def forward(self, x):
@@ -115,7 +127,7 @@ class ValueNetwork(nn.Module):
         # Value head
         x = F.relu(self.bn_value(self.conv_value(x)))
         x = self.conv_final(x)
-        x = x.view(-1, 2 * 19 * 19)
+        x = x.view(-1, 2 * self.board_size * self.board_size)
         x = F.relu(self.linear(x))
         x = self.linear_final(x)
         x = x.view(-1)
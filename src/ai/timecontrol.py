@@ -0,0 +1,127 @@
+import time
+
+# Share of the board's points a game is expected to last, used to spread main time over the remaining moves
+GAME_LENGTH_FRACTION = 0.6
+
+
+class TimeControl:
+    """
+    Clocks set by GTP time_settings / kgs-time_settings and updated by time_left (or by the engine's own
+    moves when the controller does not send time_left), and the thinking time to spend on the next move.
+    Byo-yomi is either Canadian (byo_yomi_time for byo_yomi_stones moves) or Japanese (byo_yomi_periods
+    periods of byo_yomi_time each); without byo-yomi the main time is absolute.
+    """
+
+    def __init__(self, safety_margin=1.0):
+        # Seconds kept back from every budget for network lag and the move that overruns the deadline
+        self.safety_margin = safety_margin
+        self.set_unlimited()
+
+    def set_unlimited(self):
+        """No time limit: the engine searches a fixed number of iterations"""
+        self.limited = False
+        self.main_time = 0
+        self.byo_yomi_time = 0
+        self.byo_yomi_stones = 0
+        self.byo_yomi_periods = 0
+        self.clocks = {}
+
+    def set(self, main_time, byo_yomi_time=0, byo_yomi_stones=0, byo_yomi_periods=0):
+        """Start both clocks; GTP treats byo-yomi time without stones (Canadian) as no time limit"""
+        if byo_yomi_time > 0 and byo_yomi_stones == 0 and byo_yomi_periods == 0:
+            self.set_unlimited()
+            return
+        self.limited = True
+        self.main_time = main_time
+        self.byo_yomi_time = byo_yomi_time
+        self.byo_yomi_stones = byo_yomi_stones
+        self.byo_yomi_periods = byo_yomi_periods
+        # color -> [main time left, time left in the byo-yomi period, stones (Canadian) or periods (Japanese) left]
+        self.clocks = {color: [main_time, byo_yomi_time, byo_yomi_stones or byo_yomi_periods] for color in (1, -1)}
+
+    def set_gtp(self, args):
+        """time_settings main_time byo_yomi_time byo_yomi_stones (Canadian byo-yomi)"""
+        main_time, byo_yomi_time, byo_yomi_stones = args
+        self.set(float(main_time), float(byo_yomi_time), int(byo_yomi_stones))
+
+    def set_kgs(self, args):
+        """kgs-time_settings none | absolute main | byoyomi main period periods | canadian main time stones"""
+        system = args[0]
+        if system == 'none':
+            self.set_unlimited()
+        elif system == 'absolute':
+            self.set(float(args[1]))
+        elif system == 'byoyomi':
+            self.set(float(args[1]), float(args[2]), byo_yomi_periods=int(args[3]))
+        elif system == 'canadian':
+            self.set(float(args[1]), float(args[2]), int(args[3]))
+        else:
+            raise ValueError(f'unknown time system: {system}')
+
+    @property
+    def japanese(self):
+        return self.byo_yomi_periods > 0
+
+    def time_left(self, color, seconds, stones):
+        """GTP time_left: stones 0 means main time, otherwise the time and stones (periods) of byo-yomi"""
+        if not self.limited:
+            return
+        if stones == 0:
+            self.clocks[color] = [seconds, self.byo_yomi_time, self.byo_yomi_stones or self.byo_yomi_periods]
+        else:
+            self.clocks[color] = [0, seconds, stones]
+
+    def think_time(self, color, move_number, board_size=19):
+        """Seconds to search for the next move of color, None without a time limit"""
+        if not self.limited:
+            return None
+        main, period, count = self.clocks[color]
+        # Time of one byo-yomi move, still available once main time runs out
+        if self.japanese:
+            byo_yomi = self.byo_yomi_time if count > 0 else 0
+        else:
+            byo_yomi = period / count if count > 0 else 0
+        if main > 0:
+            area = board_size * board_size
+            moves_left = max(area // 18, (area * GAME_LENGTH_FRACTION - move_number) / 2)
+            budget = main / moves_left + byo_yomi
+        else:
+            budget = byo_yomi
+        return max(budget - self.safety_margin, 0)
+
+    def spend(self, color, seconds):
+        """Charge seconds used by one move of color (keeps the clock when time_left is not sent)"""
+        if not self.limited:
+            return
+        clock = self.clocks[color]
+        used = min(clock[0], seconds)
+        clock[0] -= used
+        seconds -= used
+        if clock[0] > 0:
+            return
+        if self.japanese:
+            # A period is only used up when a move takes longer than it
+            if seconds > self.byo_yomi_time:
+                clock[2] = max(clock[2] - 1, 0)
+        elif self.byo_yomi_stones:
+            clock[1] -= seconds
+            clock[2] -= 1
+            if clock[2] <= 0:
+                # Start a new byo-yomi period
+                clock[1], clock[2] = self.byo_yomi_time, self.byo_yomi_stones
+
+
+def deadline_stop(deadline, stop=None):
+    """
+    MCTS stop function for a search ending at `deadline` (time.monotonic()). The time since its previous
+    call estimates one more round of leaf evaluation, so it stops early rather than overrun the deadline.
+    It only reads the clock, so forked root-parallel workers can use it as well.
+    """
+    last = [time.monotonic()]
+
+    def check():
+        now = time.monotonic()
+        step = now - last[0]
+        last[0] = now
+        return now + step >= deadline or (stop is not None and stop())
+    return check
@@ -3,5 +3,7 @@
 包含游戏规则和特征提取
 """
 
-from .game import Go, toDigit, toPosition, toStrPosition
-from .features import getAllFeatures 
\ No newline at end of file
+from .game import Go, BatchGo, GO_BACKENDS, newGo, convertGo, areaScores, areaOwnership, toDigit, toPosition, toStrPosition
+from .bitboard import BitboardGo
+from .features import (getAllFeatures, getAllFeaturesBatch, featureBuffer, packFeatures, unpackFeatures,
+                       unpackFeaturesTensor, transformPlanes, restorePlanes, SYMMETRY_COUNT)
\ No newline at end of file
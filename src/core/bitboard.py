@@ -0,0 +1,269 @@
+import numpy as np
+from src.core.game import (zobristTable, areaOwnership, areaScores, ZOBRIST_WHITE_TO_PLAY, HISTORY_LENGTH,
+                           RecentMoves, GameRecord)
+
+
+if hasattr(int, 'bit_count'):
+    def popcount(mask):
+        return mask.bit_count()
+else:
+    def popcount(mask):
+        return bin(mask).count('1')
+
+
+# 每种棋盘大小的位棋盘常量：(每行宽度, 棋盘内的掩码)
+# 每行多留一位作为边界，左右移位时不会串到相邻的行
+BITBOARD_LAYOUTS = {}
+
+
+def bitboardLayout(size):
+    layout = BITBOARD_LAYOUTS.get(size)
+    if layout is None:
+        width = size + 1
+        row = (1 << size) - 1
+        onBoard = 0
+        for x in range(size):
+            onBoard |= row << (x * width)
+        layout = (width, onBoard)
+        BITBOARD_LAYOUTS[size] = layout
+    return layout
+
+
+class BitboardGo:
+    """
+    位棋盘实现的棋盘状态，接口与 Go 相同
+    黑子、白子各用一个 Python 大整数表示，第 x * (size + 1) + y 位对应点 (x, y)。
+    提子、数气、连通都是移位和掩码运算；clone 只复制两个整数和 history。
+    board / liberty 在需要时从位棋盘生成并缓存。
+    play_undoable / undo 只需记录落子前的两个整数和哈希。
+    history / record 与 Go 相同：最近几手的环形缓冲区和 clone 间共享的完整棋谱。
+    """
+
+    __slots__ = ('size', 'width', 'onBoard', 'black', 'white', 'history', 'record', 'zobrist', 'hash',
+                 'superko', 'boardCache', 'libertyCache', 'undoStack')
+
+    def __init__(self, size=19, superko=False):
+        self.size = size
+        self.width, self.onBoard = bitboardLayout(size)
+        self.black = 0
+        self.white = 0
+        self.history = RecentMoves()
+        self.record = GameRecord()
+        self.zobrist = zobristTable(size)
+        self.hash = 0
+        self.superko = superko
+        self.boardCache = None
+        self.libertyCache = None
+        self.undoStack = []
+
+    @classmethod
+    def fromGo(cls, go):
+        """从任意后端的局面构造位棋盘局面"""
+        bitboard = cls(go.size, getattr(go, 'superko', False))
+        for (x, y), color in np.ndenumerate(go.board):
+            if color != 0:
+                bit = 1 << (int(x) * bitboard.width + int(y))
+                if color > 0:
+                    bitboard.black |= bit
+                else:
+                    bitboard.white |= bit
+        bitboard.history = RecentMoves(go.history)
+        bitboard.record = go.record
+        bitboard.hash = go.hash
+        return bitboard
+
+    def clone(self):
+        go = BitboardGo.__new__(BitboardGo)
+        go.size = self.size
+        go.width = self.width
+        go.onBoard = self.onBoard
+        go.black = self.black
+        go.white = self.white
+        go.history = self.history.copy()
+        go.record = self.record
+        go.zobrist = self.zobrist
+        go.hash = self.hash
+        go.superko = self.superko
+        go.boardCache = self.boardCache
+        go.libertyCache = self.libertyCache
+        go.undoStack = []
+        return go
+
+    def hashKey(self, willPlayColor):
+        """局面哈希加上轮到谁下，可作为置换表 / 缓存的键"""
+        if willPlayColor == -1:
+            return self.hash ^ ZOBRIST_WHITE_TO_PLAY
+        return self.hash
+
+    def dilate(self, mask):
+        """mask 相邻的点（不含棋盘外）"""
+        width = self.width
+        return ((mask << 1) | (mask >> 1) | (mask << width) | (mask >> width)) & self.onBoard
+
+    def flood(self, seed, stones):
+        """从 seed 出发，在 stones 中连通的棋串"""
+        group = seed
+        while True:
+            grown = (group | self.dilate(group)) & stones
+            if grown == group:
+                return group
+            group = grown
+
+    def toArray(self, mask):
+        """位掩码转为 (size, size) 的 bool 数组"""
+        width = self.width
+        length = self.size * width
+        data = np.frombuffer(mask.to_bytes((length + 7) // 8, 'little'), dtype=np.uint8)
+        bits = np.unpackbits(data, bitorder='little')[:length]
+        return bits.reshape(self.size, width)[:, :self.size].astype(bool)
+
+    @property
+    def board(self):
+        if self.boardCache is None:
+            board = np.zeros((self.size, self.size), dtype=np.int8)
+            board[self.toArray(self.black)] = 1
+            board[self.toArray(self.white)] = -1
+            self.boardCache = board
+        return self.boardCache
+
+    @property
+    def liberty(self):
+        if self.libertyCache is None:
+            liberty = np.zeros((self.size, self.size), dtype=np.int8)
+            empty = self.onBoard & ~(self.black | self.white)
+            for stones in (self.black, self.white):
+                while stones:
+                    group = self.flood(stones & -stones, stones)
+                    liberty[self.toArray(group)] = popcount(self.dilate(group) & empty)
+                    stones &= ~group
+            self.libertyCache = liberty
+        return self.libertyCache
+
+    def play_undoable(self, color, x, y):
+        """落子并记录撤销信息，返回是否合法"""
+        return self.move(color, x, y, undoable=True)
+
+    def undo(self):
+        """撤销最近一次 play_undoable 的落子"""
+        self.black, self.white, previousHash, self.boardCache, self.libertyCache = self.undoStack.pop()
+        self.hash = previousHash
+        self.record = self.record.previous
+        self.history.pop(self.record.back(HISTORY_LENGTH - 1))
+
+    def score(self, komi=7.5):
+        """数子结果，正数为黑胜，负数为白胜"""
+        return float(areaScores(self.board[None], komi)[0])
+
+    def ownership(self):
+        """每个点的归属，1 为黑，-1 为白，0 为双方都不属于"""
+        return areaOwnership(self.board[None])[0]
+
+    def legal_moves_mask(self, color):
+        """
+        color 一方所有合法落子的掩码，长度 size * size + 1，最后一位为 pass（总是合法）
+        有空邻点的空点一定合法；其余空点只看相邻棋串的气，以及打劫 / 全局同形
+        """
+        if color > 0:
+            own, another = self.black, self.white
+        else:
+            own, another = self.white, self.black
+        empty = self.onBoard & ~(own | another)
+        legal = empty & self.dilate(empty)
+
+        # 周围没有空点：连上有两口以上气的己方棋串，或者提掉只有一口气的对方棋串
+        enclosed = empty & ~legal
+        candidates = self.dilate(enclosed) & (own | another)
+        while candidates:
+            stones = own if candidates & -candidates & own else another
+            group = self.flood(candidates & -candidates, stones)
+            liberties = self.dilate(group) & empty
+            if stones == own and liberties & (liberties - 1):
+                legal |= enclosed & self.dilate(group)
+            elif stones == another and liberties & (liberties - 1) == 0:
+                legal |= liberties
+            candidates &= ~group
+
+        mask = np.zeros(self.size * self.size + 1, dtype=bool)
+        mask[:-1] = self.toArray(legal).reshape(-1)
+        mask[-1] = True
+
+        if self.superko:
+            # 逐个试下，检查落子后的局面是否出现过
+            for point in np.flatnonzero(mask[:-1]).tolist():
+                x, y = divmod(point, self.size)
+                if self.play_undoable(color, x, y):
+                    self.undo()
+                else:
+                    mask[point] = False
+        elif self.history[-2] != (None, None):
+            # 打劫点：上上手的位置被提，且周围全是对方的棋子
+            x, y = self.history[-2]
+            bit = 1 << (x * self.width + y)
+            if legal & bit and self.dilate(bit) & ~another == 0:
+                mask[x * self.size + y] = False
+
+        return mask
+
+    def move(self, color, x, y, undoable=False):
+        # 0. 检查输入是否合法
+        if not isinstance(x, int) or not isinstance(y, int):
+            return False
+        if x < 0 or x >= self.size or y < 0 or y >= self.size:
+            return False
+
+        # 1. 检查是否已经有棋子
+        bit = 1 << (x * self.width + y)
+        if (self.black | self.white) & bit:
+            return False
+
+        if color > 0:
+            own, another = self.black, self.white
+        else:
+            own, another = self.white, self.black
+        neighbors = self.dilate(bit)
+
+        # 2. 检查打劫：周围全是对方的棋子
+        if not self.superko and self.history[-2] == (x, y) and neighbors & ~another == 0:
+            return False
+
+        # 3. 落子，移除没有 liberty 的棋子
+        own |= bit
+        empty = self.onBoard & ~(own | another)
+        captured = 0
+        candidates = neighbors & another
+        while candidates:
+            group = self.flood(candidates & -candidates, another)
+            if self.dilate(group) & empty == 0:
+                captured |= group
+            candidates &= ~group
+        another &= ~captured
+        empty |= captured
+
+        if captured == 0 and self.dilate(self.flood(bit, own)) & empty == 0:
+            return False
+
+        # 落子和提子后的哈希，全局同形时不允许落子
+        ownKeys, anotherKeys = self.zobrist if color > 0 else self.zobrist[::-1]
+        newHash = self.hash ^ ownKeys[x * self.size + y]
+        while captured:
+            low = captured & -captured
+            stoneX, stoneY = divmod(low.bit_length() - 1, self.width)
+            newHash ^= anotherKeys[stoneX * self.size + stoneY]
+            captured ^= low
+        if self.superko and self.record.contains(newHash):
+            return False
+        if undoable:
+            self.undoStack.append((self.black, self.white, self.hash, self.boardCache, self.libertyCache))
+        self.hash = newHash
+
+        if color > 0:
+            self.black, self.white = own, another
+        else:
+            self.white, self.black = own, another
+        self.boardCache = None
+        self.libertyCache = None
+
+        self.history.append((x, y))
+        self.record = self.record.append((x, y), self.hash)
+
+        return True
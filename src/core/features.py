@@ -5,6 +5,8 @@
 # Zeros                   1 Constant plane
 
 import numpy as np
+import torch
+from src.core.game import FEATURE_PLANES, historyDigits, stackedFeatures
 
 
 def colorStoneFeatures(board, willPlayColor):
@@ -16,8 +18,8 @@ def colorStoneFeatures(board, willPlayColor):
     return features
 
 
-def onesFeatures():
-    features = [np.ones((19, 19))]
+def onesFeatures(size=19):
+    features = [np.ones((size, size))]
     return features
 
 
@@ -33,10 +35,10 @@ def libertiesFeatures(liberty, length=8):
     return features
 
 
-def recentOnehotFeatures(history, length=3):
+def recentOnehotFeatures(history, length=3, size=19):
     features = []
     for item in history[-length:]:
-        onehot = np.zeros((19, 19), dtype=np.int8)
+        onehot = np.zeros((size, size), dtype=np.int8)
         if item != (None, None):
             x, y = item
             onehot[x, y] = 1
@@ -44,20 +46,116 @@ def recentOnehotFeatures(history, length=3):
     return features
 
 
-def getAllFeatures(go, willPlayColor):
+def featureBuffer(count, size=19, pinMemory=False):
+    """
+    Reusable network input: a (count, 15, size, size) bool numpy array and a torch tensor
+    sharing the same memory, so filling the array with getAllFeatures(..., out=) fills the tensor
+    """
+    tensor = torch.zeros((count, FEATURE_PLANES, size, size), dtype=torch.bool, pin_memory=pinMemory)
+    return tensor.numpy(), tensor
+
+
+def getAllFeatures(go, willPlayColor, out=None):
+    """
+    The 15 input planes for willPlayColor to move. If out (a (15, size, size) array, e.g. one row
+    of a featureBuffer) is given, the planes are written into it and out is returned
+    """
+    if hasattr(go, 'features'):
+        # Go keeps incrementally updated planes; copy so callers may keep the result
+        if out is None:
+            return go.features(willPlayColor).copy()
+        np.copyto(out, go.features(willPlayColor), casting='unsafe')
+        return out
+
     board = go.board
     liberty = go.liberty
     history = go.history
 
     allFeatures = [
         colorStoneFeatures(board, willPlayColor),
-        onesFeatures(),
+        onesFeatures(go.size),
         libertiesFeatures(liberty),
         # zeros_features(),
-        recentOnehotFeatures(history)
+        recentOnehotFeatures(history, size=go.size)
     ]
     # combine all features
-    features = []
+    if out is None:
+        out = np.empty((FEATURE_PLANES, go.size, go.size), dtype=np.uint8)
+    plane = 0
     for feature in allFeatures:
-        features += feature
-    return np.array(features)
+        for item in feature:
+            out[plane] = item
+            plane += 1
+    return out
+
+
+def getAllFeaturesBatch(gos, willPlayColors, out=None):
+    """
+    getAllFeatures for a list of same-sized positions in one vectorized pass over the stacked
+    boards, liberties and recent moves; returns (N, 15, size, size), written into out if given
+    """
+    if all(hasattr(go, 'features') for go in gos):
+        # Go already keeps the planes; stacking the views is cheaper than rebuilding them
+        colors = np.broadcast_to(np.asarray(willPlayColors), (len(gos),))
+        views = [go.features(color) for go, color in zip(gos, colors.tolist())]
+        if out is None:
+            return np.stack(views).astype(bool)
+        # Row by row: np.stack only takes casting from numpy 1.24 on
+        for row, view in zip(out, views):
+            np.copyto(row, view, casting='unsafe')
+        return out
+
+    size = gos[0].size
+    boards = np.stack([go.board for go in gos])
+    liberties = np.stack([go.liberty for go in gos])
+    recent = np.array([historyDigits(go.history, 3, size) for go in gos], dtype=np.intp)
+    return stackedFeatures(boards, liberties, recent, willPlayColors, out)
+
+
+def packedSize(size=19):
+    """Bytes per packed position: 15 * size * size bits rounded up (677 for 19x19)"""
+    return (FEATURE_PLANES * size * size + 7) // 8
+
+
+def packFeatures(features):
+    """Bit-pack (..., 15, size, size) binary planes into (..., packedSize(size)) uint8"""
+    features = np.asarray(features)
+    flat = features.reshape(*features.shape[:-3], -1)
+    return np.packbits(flat.astype(bool), axis=-1)
+
+
+def unpackFeatures(packed, size=19):
+    """Inverse of packFeatures: (..., packedSize(size)) uint8 to (..., 15, size, size) bool"""
+    packed = np.asarray(packed)
+    bits = np.unpackbits(packed, axis=-1, count=FEATURE_PLANES * size * size)
+    return bits.reshape(*packed.shape[:-1], FEATURE_PLANES, size, size).view(bool)
+
+
+def unpackFeaturesTensor(packed, size=19):
+    """
+    Torch version of unpackFeatures, runs on the tensor's device, so packed data can be moved
+    to the GPU first and expanded there
+    """
+    shifts = torch.arange(7, -1, -1, dtype=torch.uint8, device=packed.device)
+    bits = (packed.unsqueeze(-1) >> shifts) & 1
+    bits = bits.reshape(*packed.shape[:-1], -1)[..., :FEATURE_PLANES * size * size]
+    return bits.bool().reshape(*packed.shape[:-1], FEATURE_PLANES, size, size)
+
+
+# The 8 dihedral symmetries of the board: symmetry % 4 quarter turns, mirrored first when symmetry >= 4
+SYMMETRY_COUNT = 8
+
+
+def transformPlanes(planes, symmetry):
+    """Apply a board symmetry (0 is the identity) to the last two axes of a tensor"""
+    if symmetry >= 4:
+        planes = planes.flip(-1)
+    return torch.rot90(planes, symmetry % 4, dims=(-2, -1))
+
+
+def restorePlanes(planes, symmetry):
+    """Inverse of transformPlanes"""
+    planes = torch.rot90(planes, -(symmetry % 4), dims=(-2, -1))
+    if symmetry >= 4:
+        planes = planes.flip(-1)
+    return planes
@@ -10,9 +10,9 @@ INDEX_TO_COLOR_CHAR = {1: 'B', -1: 'W'}
 INDEX_TO_CHAR = []
 CHAR_TO_INDEX = {}
 
-# Initialize coordinate mappings
+# Initialize coordinate mappings (up to 25x25, skipping 'I')
 char = ord('A')
-for i in range(19):
+for i in range(25):
     INDEX_TO_CHAR.append(chr(char))
     CHAR_TO_INDEX[chr(char)] = i
     char += 1
@@ -20,23 +20,463 @@ for i in range(19):
         char += 1
 
 
+# 带边界的一维棋盘：每边多一圈边界点，点 (x, y) 的下标为 (x + 1) * (size + 2) + y + 1
+# 边界点的值为 BORDER，相邻点直接用下标偏移得到，不需要判断是否越界
+BORDER = 2
+
+# 每种棋盘大小的邻接表：NEIGHBOR_TABLES[size][p] 为带边界下标 p 的棋盘内相邻点（边界点为空 tuple）
+NEIGHBOR_TABLES = {}
+
+
+def paddedIndex(x, y, size=19):
+    return (x + 1) * (size + 2) + y + 1
+
+
+def neighborOffsets(size):
+    """四个方向的下标偏移：上、下、左、右"""
+    width = size + 2
+    return (-width, width, -1, 1)
+
+
+def neighborTable(size):
+    table = NEIGHBOR_TABLES.get(size)
+    if table is None:
+        width = size + 2
+        offsets = neighborOffsets(size)
+        inside = [False] * (width * width)
+        for x in range(size):
+            for y in range(size):
+                inside[paddedIndex(x, y, size)] = True
+        table = tuple(tuple(point + offset for offset in offsets if inside[point + offset])
+                      if inside[point] else () for point in range(width * width))
+        NEIGHBOR_TABLES[size] = table
+    return table
+
+
+# 每种棋盘大小的带边界下标到 x * size + y 的映射（边界点为 -1），用于更新特征平面
+UNPADDED_TABLES = {}
+
+
+def unpaddedTable(size):
+    table = UNPADDED_TABLES.get(size)
+    if table is None:
+        width = size + 2
+        table = np.full((width, width), -1, dtype=np.intp)
+        table[1:-1, 1:-1] = np.arange(size * size).reshape(size, size)
+        table = table.reshape(-1)
+        UNPADDED_TABLES[size] = table
+    return table
+
+
+# 特征平面：空点、己方、对方、全 1、气数为 1..8、最近 3 手，与 getAllFeatures 的顺序相同
+FEATURE_PLANES = 15
+LIBERTY_LEVELS = np.arange(1, 9, dtype=np.int8)[:, None]
+
+
+# Zobrist 键：ZOBRIST_TABLES[size] = (黑子键, 白子键)，按 x * size + y 排列，另有一个表示轮到白棋的键
+# 使用固定种子生成，不同进程中同一局面的哈希一致
+ZOBRIST_TABLES = {}
+PADDED_ZOBRIST_TABLES = {}
+ZOBRIST_SEED = 20160309
+ZOBRIST_WHITE_TO_PLAY = 0x9E3779B97F4A7C15
+
+
+def zobristTable(size):
+    table = ZOBRIST_TABLES.get(size)
+    if table is None:
+        rng = np.random.default_rng(ZOBRIST_SEED + size)
+        keys = rng.integers(0, 2 ** 64, size=(2, size * size), dtype=np.uint64)
+        table = (keys[0].tolist(), keys[1].tolist())
+        ZOBRIST_TABLES[size] = table
+    return table
+
+
+def paddedZobristTable(size):
+    """与 zobristTable 相同的键，按带边界的下标排列（边界点为 0），哈希值与其他实现一致"""
+    table = PADDED_ZOBRIST_TABLES.get(size)
+    if table is None:
+        width = size + 2
+        table = []
+        for keys in zobristTable(size):
+            padded = [0] * (width * width)
+            for point, key in enumerate(keys):
+                padded[paddedIndex(*divmod(point, size), size)] = key
+            table.append(padded)
+        table = tuple(table)
+        PADDED_ZOBRIST_TABLES[size] = table
+    return table
+
+
+# 最近落子的环形缓冲区长度：特征只用最近 3 手，打劫只看上上手
+HISTORY_LENGTH = 8
+
+# 棋谱每隔这么多手保存一次之前所有局面的哈希集合，全局同形检查最多往回查这么多手
+SEEN_CHECKPOINT = 32
+
+
+class RecentMoves:
+    """
+    最近 HISTORY_LENGTH 手的环形缓冲区，按时间顺序访问，不足的部分为 (None, None)
+    支持 history[-2]、history[-3:]、迭代和与 list 比较，用法与原来的 list 相同；
+    长度固定，clone 的开销与对局长度无关
+    """
+
+    __slots__ = ('moves', 'head')
+
+    def __init__(self, moves=()):
+        self.moves = [(None, None)] * HISTORY_LENGTH
+        # head 为最早一手所在的位置，也是下一手写入的位置
+        self.head = 0
+        for move in list(moves)[-HISTORY_LENGTH:]:
+            self.append(move)
+
+    def copy(self):
+        history = RecentMoves.__new__(RecentMoves)
+        history.moves = list(self.moves)
+        history.head = self.head
+        return history
+
+    def append(self, move):
+        """追加一手，覆盖最早的一手"""
+        self.moves[self.head] = move
+        self.head = (self.head + 1) % HISTORY_LENGTH
+
+    def pop(self, oldest=(None, None)):
+        """移除最近的一手，并把 oldest（被覆盖的那一手）放回最早的位置"""
+        self.head = (self.head - 1) % HISTORY_LENGTH
+        move = self.moves[self.head]
+        self.moves[self.head] = oldest
+        return move
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(HISTORY_LENGTH))]
+        if index < 0:
+            index += HISTORY_LENGTH
+        if index < 0 or index >= HISTORY_LENGTH:
+            raise IndexError('history index out of range')
+        return self.moves[(self.head + index) % HISTORY_LENGTH]
+
+    def __len__(self):
+        return HISTORY_LENGTH
+
+    def __iter__(self):
+        return iter(self.moves[self.head:] + self.moves[:self.head])
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return f'RecentMoves({list(self)!r})'
+
+
+class GameRecord:
+    """
+    完整棋谱：不可变的链表节点，每个节点记录一手、这一手之后局面的哈希和之前的棋谱
+    追加时创建新节点，clone 和 fromGo 直接共享同一个节点，不复制棋谱
+    全局同形检查用 contains 查询出现过的局面：长度为 SEEN_CHECKPOINT 倍数的节点
+    在第一次用到时保存之前所有哈希的集合（与之前的节点共享），其余的哈希沿链表查找
+    """
+
+    __slots__ = ('move', 'previous', 'length', 'hash', 'seen')
+
+    def __init__(self, move=None, previous=None, hash=0):
+        self.move = move
+        self.previous = previous
+        self.length = previous.length + 1 if previous is not None else 0
+        self.hash = hash
+        self.seen = None
+
+    def append(self, move, hash=0):
+        """返回追加了 move（落子后局面的哈希为 hash）的新棋谱，原棋谱不变"""
+        return GameRecord(move, self, hash)
+
+    def contains(self, hash):
+        """棋谱中是否出现过哈希为 hash 的局面（包括开始时的空棋盘）"""
+        record = self
+        while record.length % SEEN_CHECKPOINT:
+            if record.hash == hash:
+                return True
+            record = record.previous
+        return hash in record.checkpoint()
+
+    def checkpoint(self):
+        """检查点及之前所有局面的哈希集合，第一次调用时计算并保存"""
+        if self.seen is None:
+            hashes = {self.hash}
+            record = self.previous
+            while record is not None and record.length % SEEN_CHECKPOINT:
+                hashes.add(record.hash)
+                record = record.previous
+            self.seen = frozenset(hashes) if record is None else record.checkpoint() | hashes
+        return self.seen
+
+    def back(self, steps):
+        """往前数 steps 手的落子（0 为最后一手），超出棋谱时为 (None, None)"""
+        record = self
+        for _ in range(steps):
+            if record.previous is None:
+                return (None, None)
+            record = record.previous
+        return record.move if record.previous is not None else (None, None)
+
+    def moves(self):
+        """按时间顺序的所有落子"""
+        moves = []
+        record = self
+        while record.previous is not None:
+            moves.append(record.move)
+            record = record.previous
+        moves.reverse()
+        return moves
+
+    def __len__(self):
+        return self.length
+
+
 class Go:
-    def __init__(self, size=19):
+    """
+    棋盘状态
+    棋子和气数保存在带边界的一维数组 cells / libertyCells 中，
+    board / liberty 是它们去掉边界后的 (size, size) 视图，供特征提取等使用。
+
+    除了 board / liberty 之外，增量维护每个棋串的棋子和气（都用带边界的下标）：
+    groupOf[p] 为点 p 所属棋串的根（空点为 -1），groupStones[root] 和
+    groupLiberties[root] 分别为该棋串的棋子（tuple）和气（frozenset）。
+    棋串记录是不可变的，clone 时只需浅拷贝字典。
+
+    hash 为当前局面（只含棋子）的 64 位 Zobrist 哈希，随落子和提子增量更新。
+    superko=True 时用 record 中记录的哈希检查全局同形（positional superko），
+    代替基于 history 的简单打劫判断；clone 共享 record，不需要复制出现过的局面。
+
+    play_undoable 落子时把被改动的棋串、被提的子和哈希记在 undoStack 中，
+    undo 按相反顺序恢复，搜索时可以在同一个棋盘上前进和回退而不必 clone。
+
+    history 只保留最近 HISTORY_LENGTH 手（环形缓冲区），完整棋谱在 record 中，
+    clone 共享同一个 record，复制的开销不随对局长度增长。
+
+    planes 为 (2, 15, size, size) 的 uint8 特征平面，planes[0] 是黑棋视角，planes[1] 是白棋视角，
+    两者只有己方 / 对方两个平面互换。落子和撤销只把改动过的点记在 dirtyPoints 中，
+    features 时只更新这些点，然后返回对应视角的视图。
+    """
+
+    __slots__ = ('size', 'width', 'cells', 'libertyCells', 'board', 'liberty', 'history', 'record',
+                 'groupOf', 'groupStones', 'groupLiberties', 'neighbors', 'offsets', 'zobrist',
+                 'hash', 'superko', 'undoStack', 'planes', 'planeIndex', 'dirtyPoints',
+                 'recentMoves')
+
+    def __init__(self, size=19, superko=False):
         self.size = size
-        self.board = np.zeros((size, size), dtype=np.int8)
-        self.liberty = np.zeros((size, size), dtype=np.int8)
-        self.previousBoard = np.zeros((size, size), dtype=np.int8)
-        self.history = [(None, None)] * 8
+        self.width = size + 2
+        self.cells = np.full(self.width * self.width, BORDER, dtype=np.int8)
+        self.libertyCells = np.zeros(self.width * self.width, dtype=np.int8)
+        self.board = self.cells.reshape(self.width, self.width)[1:-1, 1:-1]
+        self.board[:] = 0
+        self.liberty = self.libertyCells.reshape(self.width, self.width)[1:-1, 1:-1]
+        self.history = RecentMoves()
+        self.record = GameRecord()
+        self.groupOf = [-1] * (self.width * self.width)
+        self.groupStones = {}
+        self.groupLiberties = {}
+        self.neighbors = neighborTable(size)
+        self.offsets = neighborOffsets(size)
+        self.zobrist = paddedZobristTable(size)
+        self.hash = 0
+        self.superko = superko
+        self.undoStack = []
+        self.planes = np.zeros((2, FEATURE_PLANES, size, size), dtype=np.uint8)
+        self.planes[:, 0] = 1
+        self.planes[:, 3] = 1
+        self.planeIndex = unpaddedTable(size)
+        self.dirtyPoints = set()
+        self.recentMoves = ()
+
+    @classmethod
+    def fromGo(cls, go):
+        """从任意后端的局面构造数组实现的局面"""
+        result = cls(go.size, getattr(go, 'superko', False))
+        # 合法局面中的每个棋串都有气，逐个摆上棋子不会发生提子
+        for (x, y), color in np.ndenumerate(go.board):
+            if color != 0:
+                result.move(int(color), int(x), int(y))
+        result.history = RecentMoves(go.history)
+        result.record = go.record
+        return result
+
+    def hashKey(self, willPlayColor):
+        """局面哈希加上轮到谁下，可作为置换表 / 缓存的键"""
+        if willPlayColor == -1:
+            return self.hash ^ ZOBRIST_WHITE_TO_PLAY
+        return self.hash
 
     def clone(self):
-        go = Go(self.size)
-        go.board = np.array(self.board)
-        go.liberty = np.array(self.liberty)
-        go.previousBoard = np.array(self.previousBoard)
-        go.history = list(self.history)
+        go = Go.__new__(Go)
+        go.size = self.size
+        go.width = self.width
+        # board / liberty 是新数组的视图
+        go.cells = self.cells.copy()
+        go.libertyCells = self.libertyCells.copy()
+        go.board = go.cells.reshape(self.width, self.width)[1:-1, 1:-1]
+        go.liberty = go.libertyCells.reshape(self.width, self.width)[1:-1, 1:-1]
+        go.history = self.history.copy()
+        go.record = self.record
+        go.groupOf = list(self.groupOf)
+        go.groupStones = dict(self.groupStones)
+        go.groupLiberties = dict(self.groupLiberties)
+        go.neighbors = self.neighbors
+        go.offsets = self.offsets
+        go.zobrist = self.zobrist
+        go.hash = self.hash
+        go.superko = self.superko
+        go.undoStack = []
+        go.planes = self.planes.copy()
+        go.planeIndex = self.planeIndex
+        go.dirtyPoints = set(self.dirtyPoints)
+        go.recentMoves = self.recentMoves
         return go
 
-    def move(self, color, x, y):
+    def play_undoable(self, color, x, y):
+        """落子并记录撤销信息，返回是否合法"""
+        return self.move(color, x, y, undoable=True)
+
+    def undo(self):
+        """撤销最近一次 play_undoable 的落子"""
+        point, color, snapshot, previousHash, newHash = self.undoStack.pop()
+        cells = self.cells
+        libertyCells = self.libertyCells
+        groupOf = self.groupOf
+
+        cells[point] = 0
+        libertyCells[point] = 0
+        groupOf[point] = -1
+        self.dirtyPoints.add(point)
+        for root, (stones, liberties) in snapshot.items():
+            if stones is None:
+                # 落子点自己成为根的新棋串
+                self.groupStones.pop(root, None)
+                self.groupLiberties.pop(root, None)
+                continue
+            self.groupStones[root] = stones
+            self.groupLiberties[root] = liberties
+            for stone in stones:
+                groupOf[stone] = root
+            self.dirtyPoints.update(stones)
+            stones = list(stones)
+            if cells[stones[0]] == 0:
+                # 被提的棋串
+                cells[stones] = -color
+            libertyCells[stones] = len(liberties)
+
+        self.hash = previousHash
+        # 环形缓冲区中被覆盖的那一手从棋谱中取回
+        self.record = self.record.previous
+        self.history.pop(self.record.back(HISTORY_LENGTH - 1))
+
+    def score(self, komi=7.5):
+        """数子结果，正数为黑胜，负数为白胜"""
+        return float(areaScores(self.board[None], komi)[0])
+
+    def ownership(self):
+        """每个点的归属，1 为黑，-1 为白，0 为双方都不属于"""
+        return areaOwnership(self.board[None])[0]
+
+    def legal_moves_mask(self, color):
+        """
+        color 一方所有合法落子的掩码，长度 size * size + 1，最后一位为 pass（总是合法）
+        有空邻点的空点一定合法；其余空点只看相邻棋串的气，以及打劫 / 全局同形
+        """
+        size = self.size
+        width = self.width
+        cells = self.cells
+        mask = np.zeros(size * size + 1, dtype=bool)
+        mask[-1] = True
+
+        # 边界点不是空点，四个方向的切片不需要补边
+        emptyCells = (cells == 0).reshape(width, width)
+        empty = emptyCells[1:-1, 1:-1]
+        hasEmptyNeighbor = emptyCells[:-2, 1:-1] | emptyCells[2:, 1:-1] | emptyCells[1:-1, :-2] | emptyCells[1:-1, 2:]
+        mask[:-1] = (empty & hasEmptyNeighbor).reshape(-1)
+
+        # 周围没有空点：连上有两口以上气的己方棋串，或者提掉只有一口气的对方棋串
+        for x, y in zip(*np.nonzero(empty & ~hasEmptyNeighbor)):
+            point = (x + 1) * width + y + 1
+            for neighbor in self.neighbors[point]:
+                liberties = len(self.groupLiberties[self.groupOf[neighbor]])
+                if cells[neighbor] == color:
+                    legal = liberties > 1
+                else:
+                    legal = liberties == 1
+                if legal:
+                    mask[x * size + y] = True
+                    break
+
+        if self.superko:
+            # 逐个检查落子后的局面是否出现过
+            ownKeys, anotherKeys = self.zobrist if color > 0 else self.zobrist[::-1]
+            for index in np.flatnonzero(mask[:-1]).tolist():
+                x, y = divmod(index, size)
+                point = (x + 1) * width + y + 1
+                newHash = self.hash ^ ownKeys[point]
+                for root in self.capturedBy(color, point):
+                    for stone in self.groupStones[root]:
+                        newHash ^= anotherKeys[stone]
+                if self.record.contains(newHash):
+                    mask[index] = False
+        elif self.history[-2] != (None, None):
+            # 打劫点：上上手的位置被提，且周围全是对方的棋子
+            x, y = self.history[-2]
+            point = (x + 1) * width + y + 1
+            if mask[x * size + y] and all(cells[point + offset] in (-color, BORDER) for offset in self.offsets):
+                mask[x * size + y] = False
+
+        return mask
+
+    def features(self, willPlayColor):
+        """
+        willPlayColor 一方视角的网络输入，(15, size, size) 的 uint8 视图，各平面与 getAllFeatures 相同
+        视图会随之后的落子改变，需要保存时请复制
+        """
+        if self.dirtyPoints:
+            self.updatePlanes(list(self.dirtyPoints))
+            self.dirtyPoints.clear()
+        recentMoves = tuple(self.history[-3:])
+        if recentMoves != self.recentMoves:
+            self.updateRecentPlanes(recentMoves)
+        return self.planes[0 if willPlayColor == 1 else 1]
+
+    def updatePlanes(self, points):
+        """按 cells / libertyCells 重新写入 points（带边界的下标）处的棋子和气数平面"""
+        indices = self.planeIndex[points]
+        colors = self.cells[points]
+        liberties = self.libertyCells[points]
+        black = colors == 1
+        white = colors == -1
+        planes = self.planes.reshape(2, FEATURE_PLANES, -1)
+        planes[:, 0, indices] = colors == 0
+        planes[0, 1, indices] = black
+        planes[0, 2, indices] = white
+        planes[1, 1, indices] = white
+        planes[1, 2, indices] = black
+        planes[:, 4:12, indices] = liberties == LIBERTY_LEVELS
+
+    def updateRecentPlanes(self, recentMoves):
+        """最近 3 手的平面：清掉上次写入的点，再写入新的点"""
+        planes = self.planes
+        for plane, move in enumerate(self.recentMoves):
+            if move != (None, None):
+                planes[:, 12 + plane, move[0], move[1]] = 0
+        for plane, move in enumerate(recentMoves):
+            if move != (None, None):
+                planes[:, 12 + plane, move[0], move[1]] = 1
+        self.recentMoves = recentMoves
+
+    def capturedBy(self, color, point):
+        """color 落在 point（带边界的下标）时会被提掉的对方棋串的根"""
+        cells = self.cells
+        return {self.groupOf[neighbor] for neighbor in self.neighbors[point]
+                if cells[neighbor] == -color and len(self.groupLiberties[self.groupOf[neighbor]]) == 1}
+
+    def move(self, color, x, y, undoable=False):
         # 0. 检查输入是否合法
         if not isinstance(x, int) or not isinstance(y, int):
             return False
@@ -44,101 +484,385 @@ class Go:
             return False
 
         # 1. 检查是否已经有棋子
-        if self.board[x, y] != 0:
+        point = (x + 1) * self.width + y + 1
+        cells = self.cells
+        if cells[point] != 0:
             return False
 
         anotherColor = -color
         # 2. 检查打劫
-        if self.history[-2] == (x, y):
-            # 如果周围全是对方的棋子
-            if (x == 0 or self.board[x - 1, y] == anotherColor) and \
-               (y == 0 or self.board[x, y - 1] == anotherColor) and \
-               (x == self.size - 1 or self.board[x + 1, y] == anotherColor) and \
-               (y == self.size - 1 or self.board[x, y + 1] == anotherColor):
+        if not self.superko and self.history[-2] == (x, y):
+            # 如果周围全是对方的棋子（棋盘外的边界点也算）
+            if all(cells[point + offset] in (anotherColor, BORDER) for offset in self.offsets):
                 return False
 
-        # 3. 落子，移除没有 liberty 的棋子
-        self.previousBoard = np.array(self.board)
-
-        self.board[x, y] = color
-
-        if x > 0:
-            self.clearColorNear(anotherColor, x - 1, y)
-        if x < self.size - 1:
-            self.clearColorNear(anotherColor, x + 1, y)
-        if y > 0:
-            self.clearColorNear(anotherColor, x, y - 1)
-        if y < self.size - 1:
-            self.clearColorNear(anotherColor, x, y + 1)
-
-        self.clearColorNear(color, x, y)
+        # 3. 只查看相邻的棋串：找出被提的对方棋串，判断是否自杀
+        groupOf = self.groupOf
+        groupLiberties = self.groupLiberties
+
+        emptyNeighbors = []
+        ownRoots = set()
+        anotherRoots = set()
+        capturedRoots = set()
+        for neighbor in self.neighbors[point]:
+            neighborColor = cells[neighbor]
+            if neighborColor == 0:
+                emptyNeighbors.append(neighbor)
+                continue
+            root = groupOf[neighbor]
+            if neighborColor == color:
+                ownRoots.add(root)
+            elif len(groupLiberties[root]) == 1:
+                capturedRoots.add(root)
+            else:
+                anotherRoots.add(root)
+
+        if not emptyNeighbors and not capturedRoots and \
+           all(len(groupLiberties[root]) == 1 for root in ownRoots):
+            return False
 
-        if self.board[x, y] == 0:
-            self.board = self.previousBoard
+        # 落子和提子后的哈希，全局同形时不允许落子
+        ownKeys, anotherKeys = self.zobrist if color > 0 else self.zobrist[::-1]
+        newHash = self.hash ^ ownKeys[point]
+        for root in capturedRoots:
+            for stone in self.groupStones[root]:
+                newHash ^= anotherKeys[stone]
+        if self.superko and self.record.contains(newHash):
             return False
 
+        if undoable:
+            # 记录会被改动的棋串（包括因提子而长气的棋串），undo 时原样恢复
+            touchedRoots = ownRoots | anotherRoots | capturedRoots
+            for root in capturedRoots:
+                for stone in self.groupStones[root]:
+                    for neighbor in self.neighbors[stone]:
+                        if cells[neighbor] == color:
+                            touchedRoots.add(groupOf[neighbor])
+            snapshot = {root: (self.groupStones[root], groupLiberties[root]) for root in touchedRoots}
+            snapshot[point] = (None, None)
+            self.undoStack.append((point, color, snapshot, self.hash, newHash))
+        self.hash = newHash
+
+        # 4. 落子，合并己方棋串，减少对方棋串的气，移除没有 liberty 的棋子
+        cells[point] = color
+        touchedRoots = self.mergeGroups(point, ownRoots, emptyNeighbors)
+        for root in anotherRoots:
+            groupLiberties[root] = groupLiberties[root] - {point}
+            touchedRoots.add(root)
+        for root in capturedRoots:
+            touchedRoots |= self.removeGroup(root)
+        touchedRoots -= capturedRoots
+
+        libertyCells = self.libertyCells
+        dirtyPoints = self.dirtyPoints
+        dirtyPoints.add(point)
+        for root in touchedRoots:
+            stones = self.groupStones[root]
+            libertyCells[list(stones)] = len(groupLiberties[root])
+            dirtyPoints.update(stones)
+
         self.history.append((x, y))
+        self.record = self.record.append((x, y), self.hash)
 
         return True
 
-    def clearColorNear(self, color, x, y):
-        if self.board[x, y] != color:
-            return
-
-        visited = np.zeros((self.size, self.size), dtype=np.int32)
-        boardGroup = np.zeros((self.size, self.size), dtype=np.int32)
-
-        def dfs(colorBoard, x, y):
-            if visited[x, y] == 1:
-                return
-            if colorBoard[x, y] == 0:
-                if self.board[x, y] == 0:
-                    allLibertyPosition.add((x, y))
-                return
-            visited[x, y] = 1
-            boardGroup[x, y] = 1
-
-            if x > 0:
-                dfs(colorBoard, x - 1, y)
-            if x < self.size - 1:
-                dfs(colorBoard, x + 1, y)
-            if y > 0:
-                dfs(colorBoard, x, y - 1)
-            if y < self.size - 1:
-                dfs(colorBoard, x, y + 1)
-
-        colorBoard = self.board == color
-
-        allLibertyPosition = set()
-        dfs(colorBoard, x, y)
-
-        liberties = len(allLibertyPosition)
-        # dead group
-        if liberties == 0:
-            self.board[boardGroup == 1] = 0
-        else:
-            self.liberty[boardGroup == 1] = liberties
+    def mergeGroups(self, point, roots, emptyNeighbors):
+        """把新落的子和相邻的己方棋串合并，返回合并后棋串的根"""
+        groupOf = self.groupOf
+        groupStones = self.groupStones
+        # 最大的棋串保留根，其余棋子改挂到它下面
+        root = max(roots, key=lambda other: len(groupStones[other]), default=point)
+        stones = list(groupStones[root]) if root != point else []
+        liberties = set(emptyNeighbors)
+        relabel = [point]
+        for other in roots:
+            liberties |= self.groupLiberties.pop(other)
+            if other != root:
+                relabel.extend(groupStones.pop(other))
+        liberties.discard(point)
+        for stone in relabel:
+            groupOf[stone] = root
+        groupStones[root] = tuple(stones + relabel)
+        self.groupLiberties[root] = frozenset(liberties)
+        return {root}
+
+    def removeGroup(self, root):
+        """提掉整个棋串，被提的点成为相邻棋串的气，返回气数变化的棋串的根"""
+        groupOf = self.groupOf
+        stones = self.groupStones.pop(root)
+        del self.groupLiberties[root]
+
+        indices = list(stones)
+        self.cells[indices] = 0
+        self.libertyCells[indices] = 0
+        for stone in stones:
+            groupOf[stone] = -1
+        self.dirtyPoints.update(stones)
+        gained = {}
+        for stone in stones:
+            for neighbor in self.neighbors[stone]:
+                neighborRoot = groupOf[neighbor]
+                if neighborRoot >= 0:
+                    gained.setdefault(neighborRoot, set()).add(stone)
+
+        for neighborRoot, liberties in gained.items():
+            self.groupLiberties[neighborRoot] = self.groupLiberties[neighborRoot] | liberties
+        return set(gained)
+
+# 四个方向上相邻的两组点：(一侧的切片, 另一侧的切片)，用于 (N, size, size) 的批量运算
+NEIGHBOR_SLICES = (
+    ((slice(None), slice(1, None), slice(None)), (slice(None), slice(None, -1), slice(None))),
+    ((slice(None), slice(None, -1), slice(None)), (slice(None), slice(1, None), slice(None))),
+    ((slice(None), slice(None), slice(1, None)), (slice(None), slice(None), slice(None, -1))),
+    ((slice(None), slice(None), slice(None, -1)), (slice(None), slice(None), slice(1, None))),
+)
+
+
+def labelGroups(boards):
+    """
+    批量标记连通块：boards 为 (N, size, size)，值相同且相邻的非零点属于同一块
+    返回 int32 数组，非零点为所在块中最小的一维下标，值为 0 的点为 size * size
+    """
+    count, size = boards.shape[0], boards.shape[1]
+    area = size * size
+    labels = np.where(boards != 0, np.arange(area, dtype=np.int32).reshape(size, size), area)
+    labels = labels.astype(np.int32)
+    links = [(this, other, (boards[this] != 0) & (boards[this] == boards[other]))
+             for this, other in NEIGHBOR_SLICES]
+    sentinel = np.full((count, 1), area, dtype=np.int32)
+    while True:
+        new = labels.copy()
+        for this, other, link in links:
+            np.minimum(new[this], np.where(link, labels[other], area), out=new[this])
+        # 指针跳跃：取标记所指的点的标记，长条的棋串也只需要很少几轮
+        flat = np.concatenate([new.reshape(count, area), sentinel], axis=1)
+        new = np.take_along_axis(flat, new.reshape(count, area), axis=1).reshape(count, size, size)
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def countLiberties(boards, labels):
+    """批量数气：返回每个棋子所在棋串的气数（int8），空点为 0"""
+    count, size = boards.shape[0], boards.shape[1]
+    area = size * size
+    empty = boards == 0
+    groupKeys = np.arange(count, dtype=np.int64)[:, None, None] * area + labels
+    points = np.broadcast_to(np.arange(area, dtype=np.int64).reshape(size, size), boards.shape)
+    # (棋串, 相邻空点) 去重后按棋串计数
+    pairs = []
+    for this, other in NEIGHBOR_SLICES:
+        adjacent = ~empty[this] & empty[other]
+        pairs.append(groupKeys[this][adjacent] * area + points[other][adjacent])
+    pairs = np.unique(np.concatenate(pairs))
+    counts = np.bincount(pairs // area, minlength=count * area + area)
+    liberty = np.where(empty, 0, np.minimum(counts[groupKeys], 127))
+    return liberty.astype(np.int8)
+
+
+def areaOwnership(boards):
+    """
+    批量判断每个点的归属（Tromp-Taylor 规则）：棋子属于自己的颜色，
+    只与一种颜色相邻的空白区域属于该颜色，其余空点为 0
+    """
+    count, size = boards.shape[0], boards.shape[1]
+    area = size * size
+    empty = boards == 0
+    regionKeys = np.arange(count, dtype=np.int64)[:, None, None] * area + labelGroups(empty.astype(np.int8))
+    reachBlack = np.zeros(count * area + area, dtype=bool)
+    reachWhite = np.zeros(count * area + area, dtype=bool)
+    for this, other in NEIGHBOR_SLICES:
+        reachBlack[regionKeys[this][empty[this] & (boards[other] == 1)]] = True
+        reachWhite[regionKeys[this][empty[this] & (boards[other] == -1)]] = True
+    reachBlack, reachWhite = reachBlack[regionKeys], reachWhite[regionKeys]
+    ownership = boards.astype(np.int8)
+    ownership[empty & reachBlack & ~reachWhite] = 1
+    ownership[empty & reachWhite & ~reachBlack] = -1
+    return ownership
+
+
+def areaScores(boards, komi=7.5):
+    """批量数子：每盘棋黑方的子和空减去白方的子和空，再减去贴目"""
+    ownership = areaOwnership(boards)
+    return ownership.reshape(len(boards), -1).sum(axis=1, dtype=np.int32) - komi
+
+
+def historyDigits(history, length=3, size=19):
+    """最近 length 手的一维下标，按时间顺序，没有落子的位置为 -1"""
+    return [-1 if x is None else x * size + y for x, y in history[-length:]]
+
+
+def stackedFeatures(boards, liberties, recent, willPlayColors, out=None):
+    """
+    由叠在一起的 boards / liberties (N, size, size) 和最近 3 手的一维下标 recent (N, 3) 批量生成网络输入，
+    返回 (N, 15, size, size)，各平面与 getAllFeatures 相同；给出 out 时直接写入 out
+    """
+    count, size = boards.shape[0], boards.shape[1]
+    colors = np.broadcast_to(np.asarray(willPlayColors, dtype=np.int8), (count,))[:, None, None]
+    if out is None:
+        out = np.zeros((count, FEATURE_PLANES, size, size), dtype=bool)
+    out[:, 0] = boards == 0
+    out[:, 1] = boards == colors
+    out[:, 2] = boards == -colors
+    out[:, 3] = 1
+    out[:, 4:12] = liberties[:, None] == LIBERTY_LEVELS[None, :, :, None]
+    out[:, 12:15] = 0
+    boardIndex, planeIndex = np.nonzero(recent >= 0)
+    out.reshape(count, FEATURE_PLANES, size * size)[
+        boardIndex, 12 + planeIndex, recent[boardIndex, planeIndex]] = 1
+    return out
+
+
+class BatchGo:
+    """
+    N 盘棋的批量状态：board / liberty 为 (N, size, size)，history 为 (N, 8) 的最近落子一维下标（-1 为空）
+    move 对每盘棋各下一手（一次向量化调用），规则与 Go.move 相同（包括基于 history 的打劫判断）；
+    features 直接生成 (N, 15, size, size) 的网络输入
+    """
+
+    def __init__(self, count, size=19):
+        self.count = count
+        self.size = size
+        self.board = np.zeros((count, size, size), dtype=np.int8)
+        self.liberty = np.zeros((count, size, size), dtype=np.int8)
+        self.history = np.full((count, 8), -1, dtype=np.int32)
+
+    @classmethod
+    def fromGos(cls, gos):
+        """把若干个同样大小的 Go 局面合成一个 BatchGo"""
+        batch = cls(len(gos), gos[0].size)
+        for i, go in enumerate(gos):
+            batch.board[i] = go.board
+            batch.liberty[i] = go.liberty
+            batch.history[i] = historyDigits(go.history, 8, go.size)
+        return batch
+
+    def clone(self):
+        batch = BatchGo(self.count, self.size)
+        batch.board = self.board.copy()
+        batch.liberty = self.liberty.copy()
+        batch.history = self.history.copy()
+        return batch
+
+    def scores(self, komi=7.5):
+        """每盘棋的数子结果，正数为黑胜"""
+        return areaScores(self.board, komi)
+
+    def hashes(self):
+        """每盘棋的 Zobrist 哈希，与 Go.hash 相同"""
+        blackKeys, whiteKeys = (np.array(keys, dtype=np.uint64) for keys in zobristTable(self.size))
+        flat = self.board.reshape(self.count, -1)
+        keys = np.where(flat == 1, blackKeys, np.uint64(0)) ^ np.where(flat == -1, whiteKeys, np.uint64(0))
+        return np.bitwise_xor.reduce(keys, axis=1)
+
+    def move(self, colors, digits):
+        """
+        每盘棋落一子：colors 为落子方，digits 为落子点的一维下标，size * size 为 pass
+        返回每盘棋是否合法，不合法的棋盘保持不变
+        """
+        size = self.size
+        area = size * size
+        colors = np.broadcast_to(np.asarray(colors, dtype=np.int8), (self.count,))
+        digits = np.broadcast_to(np.asarray(digits, dtype=np.int64), (self.count,))
+        legal = np.ones(self.count, dtype=bool)
+
+        # 1. 检查是否已经有棋子
+        rows = np.flatnonzero(digits < area)
+        points = digits[rows]
+        occupied = self.board.reshape(self.count, area)[rows, points] != 0
+
+        # 2. 检查打劫：上上手的位置，且周围全是对方的棋子（棋盘外也算）
+        ko = self.history[rows, -2] == points
+        if ko.any():
+            padded = np.pad(self.board[rows], ((0, 0), (1, 1), (1, 1)), constant_values=2)
+            x, y = points // size + 1, points % size + 1
+            index = np.arange(len(rows))
+            neighbors = np.stack([padded[index, x - 1, y], padded[index, x + 1, y],
+                                  padded[index, x, y - 1], padded[index, x, y + 1]], axis=1)
+            anotherColors = -colors[rows, None]
+            ko &= ((neighbors == anotherColors) | (neighbors == 2)).all(axis=1)
+        invalid = occupied | ko
+        legal[rows[invalid]] = False
+        rows, points = rows[~invalid], points[~invalid]
+        if len(rows) == 0:
+            return legal
+
+        # 3. 落子，批量标记棋串并数气，移除没有 liberty 的对方棋子
+        index = np.arange(len(rows))
+        boards = self.board[rows]
+        boards.reshape(len(rows), area)[index, points] = colors[rows]
+        labels = labelGroups(boards)
+        liberty = countLiberties(boards, labels)
+        dead = (boards == -colors[rows, None, None]) & (liberty == 0)
+        captured = dead.any(axis=(1, 2))
+        suicide = ~captured & (liberty.reshape(len(rows), area)[index, points] == 0)
+
+        # 提子后相邻棋串的气增加，重新数气（其余棋串的连通关系不变）
+        if captured.any():
+            boards[dead] = 0
+            labels[dead] = area
+            liberty[captured] = countLiberties(boards[captured], labels[captured])
+
+        legal[rows[suicide]] = False
+        rows = rows[~suicide]
+        self.board[rows] = boards[~suicide]
+        self.liberty[rows] = liberty[~suicide]
+        self.history[rows, :-1] = self.history[rows, 1:]
+        self.history[rows, -1] = points[~suicide]
+        return legal
+
+    def features(self, willPlayColors):
+        """所有棋盘的网络输入，(N, 15, size, size)，各平面与 getAllFeatures 相同"""
+        return stackedFeatures(self.board, self.liberty, self.history[:, -3:], willPlayColors)
+
+
+# 可选的棋盘实现：'array' 为 Go，'bitboard' 为 BitboardGo
+GO_BACKENDS = ('array', 'bitboard')
+
+
+def goClass(backend='array'):
+    if backend == 'array':
+        return Go
+    if backend == 'bitboard':
+        from src.core.bitboard import BitboardGo
+        return BitboardGo
+    raise ValueError(f'Unknown Go backend: {backend}')
+
+
+def newGo(size=19, backend='array', superko=False):
+    """创建指定实现的空棋盘"""
+    return goClass(backend)(size, superko)
+
+
+def convertGo(go, backend):
+    """把局面转换为指定的实现，已经是该实现时直接返回"""
+    cls = goClass(backend)
+    if isinstance(go, cls):
+        return go
+    return cls.fromGo(go)
 
 
-def toDigit(x, y):
-    return x * 19 + y
+def toDigit(x, y, size=19):
+    return x * size + y
 
 
-def toPosition(digit):
+def toPosition(digit, size=19):
     if isinstance(digit, torch.Tensor):
         digit = digit.item()
-    if digit == 361:
+    # numpy 整数（如 np.random.choice 的结果）转为 int，否则 Go.move 会拒绝
+    digit = int(digit)
+    if digit == size * size:
         return None, None
-    x = digit // 19
-    y = digit % 19
+    x = digit // size
+    y = digit % size
     return x, y
 
 
-def toStrPosition(x, y):
+def toStrPosition(x, y, size=19):
         """Convert coordinates to string representation"""
         if (x, y) == (None, None):
             return ''
-        x = 19 - x
+        x = size - x
         y = INDEX_TO_CHAR[y]
         return f'{y}{x}'
 
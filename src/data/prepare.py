@@ -1,7 +1,7 @@
 from sgfmill import sgf
 from src.core.game import *
 import torch
-from src.core.features import getAllFeatures
+from src.core.features import getAllFeatures, stackedFeatures, packFeatures
 # import matplotlib.pyplot as plt
 import os
 
@@ -25,26 +25,37 @@ def preparePolicySgfFile(fileName):
 
     go = Go()
 
-    # append go.board to inputData
-    inputData = []
+    # record board, liberty and recent moves before every move (and once more at the end),
+    # then build all inputs in one vectorized pass
+    count = len(validSequence) + 1
+    boards = np.empty((count, 19, 19), dtype=np.int8)
+    liberties = np.empty((count, 19, 19), dtype=np.int8)
+    recent = np.empty((count, 3), dtype=np.intp)
+    colors = np.empty(count, dtype=np.int8)
     policyOutput = []
 
-    for move in validSequence:
+    for i, move in enumerate(validSequence):
         willPlayColor = colorCharToIndex[move[0]]
         x = move[1][0]
         y = move[1][1]
-        inputData.append(getAllFeatures(go, willPlayColor))
+        boards[i] = go.board
+        liberties[i] = go.liberty
+        recent[i] = historyDigits(go.history)
+        colors[i] = willPlayColor
         policyOutput.append(toDigit(x, y))
 
         if go.move(willPlayColor, x, y) == False:
             raise Exception('Invalid move')
 
     willPlayColor = -willPlayColor
-    inputData.append(getAllFeatures(go, willPlayColor))
+    boards[-1] = go.board
+    liberties[-1] = go.liberty
+    recent[-1] = historyDigits(go.history)
+    colors[-1] = willPlayColor
     policyOutput.append(19 * 19)  # pass
 
-    # use torch to load data
-    inputData = torch.tensor(np.array(inputData)).bool()
+    # use torch to load data, inputs are bit-packed (unpackFeaturesTensor expands them per batch)
+    inputData = torch.from_numpy(packFeatures(stackedFeatures(boards, liberties, recent, colors)))
     policyOutput = torch.tensor(np.array(policyOutput)).long().reshape(-1)
 
     return inputData, policyOutput
@@ -78,11 +89,11 @@ def prepareValueSgfFile(fileName):
             raise Exception('Invalid move')
 
     willPlayColor = -willPlayColor
-    valueInputData = np.array([getAllFeatures(go, willPlayColor)])
+    valueInputData = packFeatures(np.array([getAllFeatures(go, willPlayColor)]))
     valueOutput = np.array([winner == willPlayColor])
 
     # use torch to load data
-    valueInputData = torch.tensor(valueInputData).bool()
+    valueInputData = torch.from_numpy(valueInputData)
     valueOutput = torch.tensor(valueOutput).long().reshape(-1)
 
     return valueInputData, valueOutput
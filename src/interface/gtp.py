@@ -1,13 +1,28 @@
 from src.ai.networks import *
 from src.core.game import *
 import sys
+import time
 from src.ai.engine import Engine
 from src.core.game import CHAR_TO_INDEX as charToIndex
 from src.core.game import COLOR_CHAR_TO_INDEX as colorCharToIndex
 
-def main(use_mcts=False):
-    go = Go()
-    ai = Engine()
+def score_string(score):
+    """Format an area score as a GTP final_score result"""
+    if score > 0:
+        return f'B+{score:g}'
+    if score < 0:
+        return f'W+{-score:g}'
+    return '0'
+
+
+def main(use_mcts=False, backend='array', value_source='net', board_size=19, symmetries=1, selection='ucb1',
+         candidates=None, search_batch=1, ponder=False, search_threads=1, parallel='tree',
+         transpositions=False, cache_mb=256, rollout_depth=5):
+    ai = Engine(backend=backend, value_source=value_source, board_size=board_size, root_symmetries=symmetries,
+                selection=selection, candidates=candidates, search_batch=search_batch,
+                search_threads=search_threads, parallel=parallel, transpositions=transpositions, cache_mb=cache_mb,
+                rollout_depth=rollout_depth)
+    go = ai.new_go()
 
     # stderr output 'GTP ready'
     sys.stderr.write('GTP ready\n')
@@ -15,23 +30,35 @@ def main(use_mcts=False):
     while True:
         # implement GTP (Go Text Protocol)
         line = input().strip()
+        # Any command ends pondering; the visits it added stay in the engine's search tree
+        ai.stop_pondering()
         if line == 'quit':
             break
-        print('= ', end='')
-        if line == 'boardsize 19':
-            print('boardsize 19')
+        if line == f'boardsize {ai.board_size}':
+            ai.reset_search()
+            go = ai.new_go()
+            print(f'= boardsize {ai.board_size}')
         elif line.startswith('boardsize'):
-            print('boardsize')
+            # The networks only support the board size they were trained for
+            print('? unacceptable size')
         elif line.startswith('komi'):
-            print('komi')
+            try:
+                komi = float(line.split()[1])
+            except (IndexError, ValueError):
+                print('? syntax error')
+            else:
+                ai.reset_search()
+                ai.komi = komi
+                print('= komi')
         elif line == 'clear_board':
-            go = Go()
-            print('clear_board')
+            ai.reset_search()
+            go = ai.new_go()
+            print('= clear_board')
         elif line.startswith('play'):
             # play B F12
             color, position = line.split()[1:]
             if position == 'pass':
-                print('play PASS')
+                print('= play PASS')
             else:
                 # position = F12
                 y, x = position[0], position[1:]
@@ -41,26 +68,62 @@ def main(use_mcts=False):
                 # 18
                 # 17
 
-                x = 19 - int(x)
+                x = go.size - int(x)
                 y = charToIndex[y]
 
                 color = colorCharToIndex[color]
 
                 if go.move(color, x, y) == False:
-                    print('Illegal move')
+                    print('? illegal move')
+                else:
+                    print('= ok')
+        elif line.startswith(('time_settings', 'kgs-time_settings', 'time_left')):
+            command, args = line.split()[0], line.split()[1:]
+            try:
+                if command == 'time_settings':
+                    # time_settings main_time byo_yomi_time byo_yomi_stones
+                    ai.time_control.set_gtp(args)
+                elif command == 'kgs-time_settings':
+                    # kgs-time_settings none | absolute 300 | byoyomi 300 30 5 | canadian 300 300 25
+                    ai.time_control.set_kgs(args)
                 else:
-                    print('ok')
+                    # time_left B 290 0
+                    colorChar, seconds, stones = args
+                    ai.time_control.time_left(colorCharToIndex[colorChar], float(seconds), int(stones))
+            except (IndexError, KeyError, ValueError):
+                print('? syntax error')
+            else:
+                print('= ', end='')
         elif line.startswith('genmove'):
+            start = time.monotonic()
             colorChar = line.split()[1]
             willPlayColor = colorCharToIndex[colorChar]
+            print('= ', end='')
             if use_mcts:
                 ai.gen_move_mcts(go, willPlayColor)
+                if ponder:
+                    # Keep searching while the opponent thinks
+                    ai.start_pondering(go, -willPlayColor)
             else:
                 ai.gen_move_policy(go, willPlayColor)
+            # Keep our clock running when the controller does not send time_left
+            ai.time_control.spend(willPlayColor, time.monotonic() - start)
 
+        elif line.startswith('final_score'):
+            print('= ' + score_string(go.score(ai.komi)))
+        elif line.startswith('final_status_list'):
+            # Area scoring treats every stone on the board as alive
+            status = line.split()[1]
+            print('= ', end='')
+            if status == 'alive':
+                labels = labelGroups(go.board[None])[0]
+                for label in np.unique(labels[go.board != 0]):
+                    xs, ys = np.nonzero(labels == label)
+                    print(' '.join(toStrPosition(int(x), int(y), go.size) for x, y in zip(xs, ys)))
         elif line.startswith('showboard'):
-            for i in range(19):
-                for j in range(19):
+            print('= ', end='')
+            for i in range(go.size):
+                for j in range(go.size):
                     if go.board[i][j] == 1:
                         print('X', end='')
                     elif go.board[i][j] == -1:
@@ -71,18 +134,18 @@ def main(use_mcts=False):
         # name
         elif line.startswith('name'):
             if use_mcts:
-                print('wuwei (MCTS)')
+                print('= wuwei (MCTS)')
             else:
-                print('wuwei (策略网络)')
+                print('= wuwei (策略网络)')
         # version
         elif line.startswith('version'):
-            print('0.1')
+            print('= 0.1')
         # protocol_version
         elif line.startswith('protocol_version'):
-            print('2')
+            print('= 2')
         # list_commands
         elif line.startswith('list_commands'):
-            print('name')
+            print('= name')
             print('version')
             print('protocol_version')
             print('list_commands')
@@ -91,9 +154,15 @@ def main(use_mcts=False):
             print('showboard')
             print('play')
             print('genmove')
+            print('komi')
+            print('time_settings')
+            print('kgs-time_settings')
+            print('time_left')
+            print('final_score')
+            print('final_status_list')
             print('quit')
         else:
-            print('Unknown command')
+            print('? unknown command')
 
         print()
 
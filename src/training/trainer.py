@@ -1,6 +1,7 @@
 from src.core.game import *
 from src.data.prepare import *
 from src.ai.networks import *
+from src.core.features import unpackFeaturesTensor
 import sys
 import os
 
@@ -41,6 +42,14 @@ def splitData(inputData, outputData, ratio):
     return trainInputData, trainOutputData, testInputData, testOutputData
 
 
+def toInputBatch(inputDataBatch):
+    # move a batch to the device; bit-packed datasets (uint8) are expanded only here
+    inputDataBatch = inputDataBatch.to(device)
+    if inputDataBatch.dtype == torch.uint8:
+        inputDataBatch = unpackFeaturesTensor(inputDataBatch)
+    return inputDataBatch
+
+
 def trainPolicy(net, outputFileName, epoch=10):
     # optimizer = torch.optim.Adam(net.parameters(), lr=0.001)
     optimizer = torch.optim.SGD(net.parameters(), lr=0.01, momentum=0.9)
@@ -77,7 +86,7 @@ def trainPolicy(net, outputFileName, epoch=10):
                                               batchSize:(i + 1) * batchSize].reshape(-1)
 
             # use cuda to train
-            inputDataBatch = inputDataBatch.to(device)
+            inputDataBatch = toInputBatch(inputDataBatch)
             outputDataBatch = outputDataBatch.to(device)
 
             # forward
@@ -115,7 +124,7 @@ def trainPolicy(net, outputFileName, epoch=10):
                 testOutputDataBatch = testOutputData[i *
                                                      batchSize:(i + 1) * batchSize].reshape(-1)
 
-                testInputDataBatch = testInputDataBatch.to(device)
+                testInputDataBatch = toInputBatch(testInputDataBatch)
                 testOutputDataBatch = testOutputDataBatch.to(device)
 
                 output = net(testInputDataBatch)
@@ -175,7 +184,7 @@ def trainValue(net, outputFileName, epoch=10):
                                               batchSize:(i + 1) * batchSize].reshape(-1)
 
             # use cuda to train
-            inputDataBatch = inputDataBatch.to(device)
+            inputDataBatch = toInputBatch(inputDataBatch)
             outputDataBatch = outputDataBatch.to(device)
 
             # forward
@@ -214,7 +223,7 @@ def trainValue(net, outputFileName, epoch=10):
                 testOutputDataBatch = testOutputData[i *
                                                      batchSize:(i + 1) * batchSize].reshape(-1)
 
-                testInputDataBatch = testInputDataBatch.to(device)
+                testInputDataBatch = toInputBatch(testInputDataBatch)
                 testOutputDataBatch = testOutputDataBatch.to(device)
 
                 output = net(testInputDataBatch)
@@ -4,9 +4,11 @@
 
 import sys
 import os
+import numpy as np
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from src.core.game import Go, toDigit, toPosition
+from src.core.game import Go, BatchGo, BORDER, paddedIndex, newGo, convertGo, toDigit, toPosition, toStrPosition
+from src.core.bitboard import BitboardGo
 
 def test_basic_moves():
     """测试基本移动"""
@@ -56,6 +58,315 @@ def test_liberty():
     
     print("气数计算测试通过")
 
+def test_group_tracking():
+    """测试棋串和气的增量维护"""
+    go = Go()
+
+    # 白棋一子被提后，相邻的黑棋棋串应当重新获得气
+    go.move(1, 0, 1)
+    go.move(-1, 0, 0)
+    go.move(1, 5, 5)
+    go.move(-1, 1, 1)
+    go.move(1, 1, 0)
+    assert go.board[0, 0] == 0
+    assert go.liberty[0, 0] == 0
+    assert go.liberty[1, 0] == go.liberty[0, 1] == 2
+    assert go.liberty[1, 1] == 2
+
+    # 自杀的落子不改变棋盘
+    go.move(1, 10, 10)
+    go.move(1, 10, 12)
+    go.move(1, 9, 11)
+    go.move(1, 11, 11)
+    board = go.board.copy()
+    liberty = go.liberty.copy()
+    assert go.move(-1, 10, 11) == False
+    assert (go.board == board).all()
+    assert (go.liberty == liberty).all()
+
+    # 合并后的棋串共享同一个根
+    go.move(1, 5, 6)
+    assert go.groupOf[paddedIndex(5, 5)] == go.groupOf[paddedIndex(5, 6)]
+    assert go.liberty[5, 5] == go.liberty[5, 6] == 6
+
+    # board / liberty 是带边界的一维数组的视图，clone 之后仍然指向自己的数组
+    assert go.cells[paddedIndex(5, 5)] == 1
+    assert go.cells[0] == go.cells[-1] == BORDER
+    clone = go.clone()
+    clone.move(-1, 5, 7)
+    assert clone.board[5, 7] == -1 and clone.cells[paddedIndex(5, 7)] == -1
+    assert go.board[5, 7] == 0
+    assert clone.liberty[5, 5] == 5 and go.liberty[5, 5] == 6
+
+    print("棋串维护测试通过")
+
+def test_zobrist_hash():
+    """测试 Zobrist 哈希与全局同形"""
+    # 不同的落子顺序到达同一局面，哈希相同
+    a = Go()
+    b = Go()
+    for color, x, y in [(1, 3, 3), (-1, 15, 15), (1, 3, 15), (-1, 15, 3)]:
+        a.move(color, x, y)
+    for color, x, y in [(1, 3, 15), (-1, 15, 3), (1, 3, 3), (-1, 15, 15)]:
+        b.move(color, x, y)
+    assert a.hash == b.hash
+    assert a.hashKey(1) != a.hashKey(-1)
+    assert Go().hash == 0
+
+    # 打劫：提回会重复之前的局面
+    go = Go(superko=True)
+    for color, x, y in [(1, 0, 1), (-1, 0, 2), (1, 2, 1), (-1, 2, 2),
+                        (1, 1, 0), (-1, 1, 3), (-1, 1, 1), (1, 1, 2)]:
+        assert go.move(color, x, y)
+    assert go.board[1, 1] == 0
+    assert go.move(-1, 1, 1) == False
+
+    # 克隆保留哈希；在别处交换一手后可以提劫
+    clone = go.clone()
+    assert clone.hash == go.hash
+    assert clone.move(-1, 10, 10) and clone.move(1, 10, 11)
+    assert clone.move(-1, 1, 1)
+    assert clone.hash != go.hash
+
+    # 出现过的局面记在共享的棋谱中（超过检查点也能查到），undo 后不再算出现过
+    long = Go(9, superko=True)
+    hashes = [0]
+    for i in range(70):
+        x, y = divmod(i, 9)
+        assert long.move(1 if i % 2 == 0 else -1, x, (y * 2) % 9)
+        hashes.append(long.hash)
+    assert all(long.record.contains(h) for h in hashes)
+    assert long.clone().record is long.record
+    long.play_undoable(1, 8, 8)
+    newHash = long.hash
+    long.undo()
+    assert not long.record.contains(newHash) and long.record.contains(hashes[-1])
+
+    print("Zobrist 哈希测试通过")
+
+def test_bitboard_backend():
+    """测试位棋盘实现与数组实现结果一致"""
+    import random
+    rng = random.Random(0)
+    go = newGo(backend='array')
+    bitboard = newGo(backend='bitboard')
+    assert isinstance(bitboard, BitboardGo)
+
+    color = 1
+    for i in range(300):
+        x, y = rng.randrange(19), rng.randrange(19)
+        result = go.move(color, x, y)
+        assert bitboard.move(color, x, y) == result
+        if result:
+            color = -color
+    assert (go.board == bitboard.board).all()
+    assert (go.liberty == bitboard.liberty).all()
+    assert go.hash == bitboard.hash
+
+    # 克隆互不影响，两种实现可以相互转换
+    clone = bitboard.clone()
+    clone.move(color, *next((x, y) for x in range(19) for y in range(19) if go.board[x, y] == 0))
+    assert (bitboard.board == go.board).all()
+    converted = convertGo(bitboard, 'array')
+    assert (converted.liberty == go.liberty).all() and converted.hash == go.hash
+
+    print("位棋盘测试通过")
+
+def test_undo():
+    """测试可撤销的落子"""
+    for backend in ('array', 'bitboard'):
+        go = newGo(backend=backend)
+        go.move(1, 0, 1)
+        go.move(-1, 0, 0)
+        board = go.board.copy()
+        liberty = go.liberty.copy()
+        hash = go.hash
+        history = list(go.history)
+
+        # 提子和普通落子都能撤销
+        assert go.play_undoable(1, 1, 0)
+        assert go.board[0, 0] == 0
+        assert go.play_undoable(-1, 1, 1)
+        go.undo()
+        go.undo()
+        assert (go.board == board).all()
+        assert (go.liberty == liberty).all()
+        assert go.hash == hash
+        assert go.history == history
+        assert go.undoStack == []
+
+    print("撤销测试通过")
+
+def test_history_record():
+    """测试最近落子的环形缓冲区和共享的完整棋谱"""
+    for backend in ('array', 'bitboard'):
+        go = newGo(backend=backend)
+        moves = [(x, y) for x in range(0, 19, 2) for y in range(0, 4, 2)]
+        for i, (x, y) in enumerate(moves):
+            assert go.move(1 if i % 2 == 0 else -1, x, y)
+        assert len(go.history) == 8
+        assert list(go.history) == moves[-8:]
+        assert go.history[-1] == moves[-1] and go.history[-3:] == moves[-3:]
+        assert go.record.moves() == moves
+
+        # clone 共享棋谱，之后各自追加
+        clone = go.clone()
+        assert clone.record is go.record
+        clone.move(1, 18, 18)
+        assert go.record.moves() == moves
+        assert clone.record.moves() == moves + [(18, 18)]
+
+        # 撤销时从棋谱中取回被覆盖的最早一手
+        go.play_undoable(1, 18, 18)
+        assert go.history[0] == moves[-7]
+        go.undo()
+        assert list(go.history) == moves[-8:]
+        assert go.record.moves() == moves
+
+    print("棋谱测试通过")
+
+def test_feature_planes():
+    """测试增量维护的特征平面与重新生成的结果一致"""
+    from src.core.features import getAllFeatures, getAllFeaturesBatch, featureBuffer
+    go = Go()
+    for color, x, y in [(1, 0, 1), (-1, 0, 0), (1, 3, 3), (-1, 1, 1), (1, 1, 0), (-1, 3, 4)]:
+        go.move(color, x, y)
+    go.play_undoable(1, 10, 10)
+    go.undo()
+    bitboard = BitboardGo.fromGo(go)
+    for color in (1, -1):
+        features = go.features(color)
+        assert features.shape == (15, 19, 19) and features.dtype == np.uint8
+        assert (features == getAllFeatures(bitboard, color)).all()
+
+    # 两个视角只是同一缓冲区中的视图，己方 / 对方平面互换
+    assert np.shares_memory(go.features(1), go.planes)
+    assert (go.features(1)[1] == go.features(-1)[2]).all()
+
+    # 写入共享内存的输入缓冲区，张量随之改变
+    array, tensor = featureBuffer(2)
+    getAllFeatures(go, 1, out=array[0])
+    getAllFeatures(bitboard, -1, out=array[1])
+    assert (tensor[0].numpy() == go.features(1)).all()
+    assert (tensor[1].numpy() == go.features(-1)).all()
+
+    # 批量生成：数组实现直接叠加平面，位棋盘走向量化的路径
+    positions = [Go(), go, go.clone()]
+    colors = [1, -1, 1]
+    expected = np.array([getAllFeatures(position, color) for position, color in zip(positions, colors)])
+    assert (getAllFeaturesBatch(positions, colors) == expected).all()
+    assert (getAllFeaturesBatch([convertGo(position, 'bitboard') for position in positions], colors) == expected).all()
+
+    # 写入预先分配的 bool 缓冲区：数组实现的平面视图和混合后端的向量化路径都要正确转换类型
+    for batch in (positions, [positions[0], convertGo(go, 'bitboard'), positions[2]]):
+        array, tensor = featureBuffer(3)
+        array[:] = True
+        assert getAllFeaturesBatch(batch, colors, out=array) is array
+        assert array.dtype == np.bool_ and (array == expected).all()
+        assert (tensor.numpy() == expected).all()
+
+    print("特征平面测试通过")
+
+def test_feature_packing():
+    """测试特征平面的位压缩与解压"""
+    import torch
+    from src.core.features import getAllFeaturesBatch, packFeatures, unpackFeatures, unpackFeaturesTensor, packedSize
+    positions = [Go(), Go(), Go(9)]
+    positions[1].move(1, 3, 3)
+    positions[1].move(-1, 3, 4)
+    features = getAllFeaturesBatch(positions[:2], [1, -1])
+
+    packed = packFeatures(features)
+    assert packed.shape == (2, packedSize()) and packedSize() == 677
+    assert (unpackFeatures(packed) == features).all()
+    assert (unpackFeaturesTensor(torch.from_numpy(packed)).numpy() == features).all()
+
+    small = getAllFeaturesBatch(positions[2:], [1])
+    assert (unpackFeaturesTensor(torch.from_numpy(packFeatures(small)), 9).numpy() == small).all()
+
+    print("特征压缩测试通过")
+
+def test_symmetries():
+    """测试棋盘对称变换与逆变换"""
+    import torch
+    from src.core.features import transformPlanes, restorePlanes, SYMMETRY_COUNT
+    go = Go()
+    go.move(1, 2, 3)
+    planes = torch.from_numpy(go.features(-1).copy())
+    transformed = [transformPlanes(planes, symmetry) for symmetry in range(SYMMETRY_COUNT)]
+    # 8 个变换各不相同，逆变换还原
+    assert len({tuple(np.flatnonzero(plane[2].numpy())) for plane in transformed}) == SYMMETRY_COUNT
+    for symmetry, plane in enumerate(transformed):
+        assert (restorePlanes(plane, symmetry) == planes).all()
+    assert (transformed[0] == planes).all()
+
+    print("对称变换测试通过")
+
+def test_legal_moves_mask():
+    """测试合法落子掩码与逐个试下的结果一致"""
+    for backend in ('array', 'bitboard'):
+        go = newGo(backend=backend)
+        # 打劫局面：白棋不能立即提回
+        for color, x, y in [(1, 0, 1), (-1, 0, 2), (1, 2, 1), (-1, 2, 2),
+                            (1, 1, 0), (-1, 1, 3), (-1, 1, 1), (1, 1, 2)]:
+            go.move(color, x, y)
+        for color in (1, -1):
+            mask = go.legal_moves_mask(color)
+            assert mask.shape == (19 * 19 + 1,) and mask[-1]
+            for digit in range(19 * 19):
+                x, y = toPosition(digit)
+                assert mask[digit] == go.clone().move(color, x, y)
+        assert not go.legal_moves_mask(-1)[toDigit(1, 1)]
+
+    print("合法落子掩码测试通过")
+
+def test_batch_go():
+    """测试批量棋盘与逐盘落子的结果一致"""
+    import numpy as np
+    from src.core.features import getAllFeatures
+    rng = np.random.default_rng(0)
+    count = 8
+    gos = [Go() for _ in range(count)]
+    batch = BatchGo(count)
+    colors = np.ones(count, dtype=np.int8)
+    for step in range(200):
+        digits = rng.integers(0, 19 * 19 + 1, count)
+        legal = batch.move(colors, digits)
+        for i, go in enumerate(gos):
+            x, y = toPosition(digits[i])
+            assert legal[i] == (x is None or go.move(int(colors[i]), x, y))
+        colors = np.where(legal, -colors, colors)
+
+    features = batch.features(colors)
+    assert features.shape == (count, 15, 19, 19)
+    for i, go in enumerate(gos):
+        assert (batch.board[i] == go.board).all()
+        assert (batch.liberty[i] == go.liberty).all()
+        assert (features[i] == getAllFeatures(go, colors[i]).astype(bool)).all()
+    assert batch.hashes().tolist() == [go.hash for go in gos]
+
+    print("批量棋盘测试通过")
+
+def test_area_score():
+    """测试数子"""
+    go = Go(5)
+    # 黑棋占左边三列，白棋占右边两列
+    for x in range(5):
+        go.move(1, x, 2)
+        go.move(-1, x, 3)
+    assert (go.ownership()[:, :3] == 1).all()
+    assert (go.ownership()[:, 3:] == -1).all()
+    assert go.score(komi=0.5) == 15 - 10 - 0.5
+
+    # 与双方都相邻的空白区域不属于任何一方
+    go = Go()
+    go.move(1, 3, 3)
+    go.move(-1, 15, 15)
+    assert go.score(komi=7.5) == -7.5
+    assert newGo(backend='bitboard').score(komi=0) == 0
+
+    print("数子测试通过")
+
 def test_coordinate_conversion():
     """测试坐标转换"""
     # 测试数字到坐标的转换
@@ -68,6 +379,12 @@ def test_coordinate_conversion():
     # 测试坐标到数字的转换
     digit = toDigit(0, 0)
     assert digit == 0
+
+    # 小棋盘
+    assert toPosition(81, 9) == (None, None)
+    assert toPosition(80, 9) == (8, 8)
+    assert toDigit(8, 8, 9) == 80
+    assert toStrPosition(0, 0, 9) == 'A9'
     
     print("坐标转换测试通过")
 
@@ -75,5 +392,16 @@ if __name__ == '__main__':
     test_basic_moves()
     test_capture()
     test_liberty()
+    test_group_tracking()
+    test_zobrist_hash()
+    test_bitboard_backend()
+    test_undo()
+    test_history_record()
+    test_feature_planes()
+    test_feature_packing()
+    test_symmetries()
+    test_legal_moves_mask()
+    test_batch_go()
+    test_area_score()
     test_coordinate_conversion()
     print("所有测试通过！") 
\ No newline at end of file
@@ -0,0 +1,440 @@
+"""
+蒙特卡洛树搜索测试（用固定的假网络，不需要模型文件）
+"""
+
+import sys
+import os
+import time
+import numpy as np
+import torch
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.core.game import Go
+from src.ai.mcts import MCTSNode, MCTSTree, MCTS, MCTSRootParallel, reuseTree, sampleMoves, \
+    transpositionKey
+from src.ai.timecontrol import TimeControl, deadline_stop
+from src.ai.cache import EvaluationCache, result_bytes
+
+
+def fakePolicy(go, willPlayColor, symmetries=1):
+    """由局面哈希决定的策略输出"""
+    generator = torch.Generator().manual_seed(go.hashKey(willPlayColor) % (2 ** 31))
+    return torch.randn(go.size * go.size + 1, generator=generator)
+
+
+def fakePlayout(go, willPlayColor):
+    return torch.log_softmax(fakePolicy(go, willPlayColor), dim=0)
+
+
+def fakeValue(go, willPlayColor):
+    return (go.hash % 1000) / 1000
+
+
+def test_mcts_tree():
+    """测试数组存储的搜索树"""
+    go = Go(9)
+    go.move(1, 2, 2)
+    np.random.seed(0)
+    root = MCTSNode(go, -1, None)
+    best = MCTS(root, fakePolicy, fakePlayout, fakeValue, iterations=60)
+    tree = root.tree
+
+    # 根节点的访问次数等于迭代次数，子节点的访问次数之和少一（第一次展开根节点）
+    assert root.N == 60
+    assert sum(child.N for child in root.children) == 59
+    assert best == max(root.children, key=lambda child: child.N)
+    assert best.parent == root and best.color == 1 and best.go is None
+
+    # 子节点在数组中连续存放，父节点下标一致
+    for index in range(tree.count):
+        children = tree.childSlice(index)
+        assert (tree.parent[children] == index).all()
+        assert (tree.color[children] == -tree.color[index]).all()
+
+    # 搜索结束后根节点的局面不变
+    assert tree.go.hash == go.hash and tree.go.undoStack == []
+
+    # 容量不够时自动扩大
+    small = MCTSTree(go, 1, capacity=2)
+    small.addChildren(0, [0, 1, 2, 3, 4])
+    assert small.count == 6 and len(small.N) >= 6
+
+    print("搜索树测试通过")
+
+
+def test_puct():
+    """测试 PUCT 选择和候选落子数"""
+    go = Go(9)
+    go.move(1, 4, 4)
+    np.random.seed(0)
+    root = MCTSNode(go, -1, None)
+    MCTS(root, fakePolicy, fakePlayout, fakeValue, iterations=80, selection='puct')
+    tree = root.tree
+
+    # 默认保留全部合法落子，先验概率之和为 1
+    legal = go.legal_moves_mask(-1)[:-1]
+    assert len(root.children) == legal.sum()
+    assert abs(tree.prior[tree.childSlice(0)].sum() - 1) < 1e-5
+    assert root.N == 80
+
+    # 只有访问过的子节点才展开，候选落子数可以限制
+    for child in root.children:
+        assert child.children == [] or child.N > 0
+    root = MCTSNode(go, -1, None)
+    MCTS(root, fakePolicy, fakePlayout, fakeValue, iterations=20, selection='puct', candidates=3)
+    assert len(root.children) == 3
+    assert all(len(child.children) <= 3 for child in root.children)
+
+    print("PUCT 测试通过")
+
+
+def test_batched_search():
+    """测试虚拟损失收集多个叶节点的批量搜索"""
+    go = Go(9)
+    go.move(1, 4, 4)
+    calls = []
+
+    def policyBatch(gos, colors):
+        calls.append(len(gos))
+        return torch.stack([fakePolicy(position, color) for position, color in zip(gos, colors)])
+
+    np.random.seed(0)
+    root = MCTSNode(go, -1, None)
+    best = MCTS(root, fakePolicy, fakePlayout, fakeValue, iterations=40, selection='puct',
+                batchSize=8, getPolicyNetResults=policyBatch)
+    tree = root.tree
+
+    # 第一轮只有根节点，之后每轮批量展开多个不同的叶节点
+    assert calls[0] == 1 and max(calls) == 8
+    assert sum(calls) == 40
+    # 虚拟损失全部撤销：根节点的访问次数等于评估的叶节点数，每个节点的访问次数等于子节点之和加上自己被评估的一次
+    assert root.N == 40
+    for index in range(tree.count):
+        children = tree.childSlice(index)
+        if tree.N[index]:
+            assert tree.N[index] == tree.N[children].sum() + 1
+    assert best.N == max(child.N for child in root.children)
+    assert tree.go.hash == go.hash and tree.go.undoStack == []
+
+    print("批量搜索测试通过")
+
+
+def test_reuse_tree():
+    """测试落子后复用搜索树的子树"""
+    go = Go(9)
+    go.move(1, 4, 4)
+    np.random.seed(0)
+    root = MCTSNode(go, -1, None)
+    best = MCTS(root, fakePolicy, fakePlayout, fakeValue, iterations=60, selection='puct')
+    reply = max(best.children, key=lambda child: child.N)
+    tree = root.tree
+
+    # 没有新的落子时就是原来的根节点
+    assert reuseTree(root, go, -1) == root
+
+    single = go.clone()
+    # 下了 best 和 reply 两手之后，reply 成为新的根节点，子树的访问次数和价值都保留
+    go.move(-1, *best.move)
+    go.move(1, *reply.move)
+    reused = reuseTree(root, go, -1)
+    assert reused.N == reply.N and reused.color == -1
+    assert abs(reused.Q - reply.Q) < 1e-9
+    assert reused.tree.go.hash == go.hash
+    assert sorted((child.move, child.N) for child in reused.children) == \
+        sorted((child.move, child.N) for child in reply.children)
+    for index in range(reused.tree.count):
+        children = reused.tree.childSlice(index)
+        assert (reused.tree.parent[children] == index).all()
+
+    # 只下了一手时换成对方的视角：价值变为 N - valueSum
+    single.move(-1, *best.move)
+    promoted = reuseTree(root, single, 1)
+    assert promoted.N == best.N and abs(promoted.Q - (best.N - best.Q)) < 1e-9
+
+    # 棋谱对不上（例如重新开始的对局）或轮到的一方不同时不能复用
+    replayed = Go(9)
+    replayed.move(1, 4, 4)
+    assert reuseTree(root, replayed, -1) is None
+    assert reuseTree(root, single, -1) is None
+    assert tree.count > reused.tree.count
+
+    print("搜索树复用测试通过")
+
+
+def test_stop():
+    """测试用 stop 提前结束搜索（后台思考）"""
+    go = Go(9)
+    np.random.seed(0)
+    for batchSize in (1, 4):
+        calls = []
+
+        def value(position, willPlayColor):
+            calls.append(willPlayColor)
+            return fakeValue(position, willPlayColor)
+
+        root = MCTSNode(go, 1, None)
+        MCTS(root, fakePolicy, fakePlayout, value, iterations=1000, selection='puct', batchSize=batchSize,
+             stop=lambda: len(calls) >= 9)
+        assert root.N == 9
+        # 结束时没有留下虚拟损失
+        assert root.N == sum(child.N for child in root.children) + 1
+
+    # 模拟到一半时停止：放弃这一轮，撤销虚拟损失，没有评估完的叶节点不展开
+    for batchSize in (1, 4):
+        calls = []
+
+        def playout(position, willPlayColor):
+            calls.append(willPlayColor)
+            return fakePlayout(position, willPlayColor)
+
+        root = MCTSNode(go, 1, None)
+        MCTS(root, fakePolicy, playout, fakeValue, iterations=1000, selection='puct', batchSize=batchSize,
+             stop=lambda: len(calls) >= 7)
+        tree = root.tree
+        assert root.N == 1 and tree.go.undoStack == [] and tree.go.hash == go.hash
+        assert tree.N[:tree.count].sum() == 1
+        assert (tree.childCount[1:tree.count] == 0).all()
+
+    print("提前结束搜索测试通过")
+
+
+def test_stop_pondering():
+    """测试后台思考在一次网络调用之内停止（用随机初始化的 9 路网络）"""
+    import io
+    import tempfile
+    import contextlib
+    from src.ai.engine import Engine
+    from src.ai.networks import PolicyNetwork, PlayoutNetwork, ValueNetwork, model_file_name
+
+    with tempfile.TemporaryDirectory() as path:
+        networks = (('policyNet', PolicyNetwork), ('playoutNet', PlayoutNetwork), ('valueNet', ValueNetwork))
+        for name, network in networks:
+            torch.save(network(9).state_dict(), os.path.join(path, model_file_name(name, 9)))
+        ai = Engine(path=path, board_size=9, search_batch=16, cache_mb=0)
+
+    go = ai.new_go()
+    go.move(1, 2, 2)
+    # 最慢的网络调用：一批 16 个局面的策略网络
+    positions = [go.clone() for _ in range(16)]
+    ai.get_policy_net_results(positions, [-1] * 16)
+    start = time.monotonic()
+    ai.get_policy_net_results(positions, [-1] * 16)
+    callTime = time.monotonic() - start
+
+    with contextlib.redirect_stderr(io.StringIO()):
+        for wait in (0.2, 0.25, 0.3):
+            ai.start_pondering(go, -1)
+            time.sleep(wait)
+            start = time.monotonic()
+            ai.stop_pondering()
+            assert time.monotonic() - start < 2 * callTime + 0.05
+            # 放弃的一轮没有留下虚拟损失
+            root = ai.search_root
+            assert root.N > 0 and root.N == sum(child.N for child in root.children) + 1
+
+    print("停止后台思考测试通过")
+
+
+def test_parallel_search():
+    """测试树并行（多线程）和根并行（多进程）搜索"""
+    go = Go(9)
+    go.move(1, 4, 4)
+    np.random.seed(0)
+    root = MCTSNode(go, -1, None)
+    best = MCTS(root, fakePolicy, fakePlayout, fakeValue, iterations=48, selection='puct', threads=4)
+    tree = root.tree
+
+    # 所有线程的虚拟损失都已撤销，每个节点恰好被评估一次
+    assert root.N == 48
+    for index in range(tree.count):
+        if tree.N[index]:
+            assert tree.N[index] == tree.N[tree.childSlice(index)].sum() + 1
+    assert best.N == max(child.N for child in root.children)
+    assert tree.go.hash == go.hash
+
+    # 每个线程每次用虚拟损失选出一批叶节点，各线程的批次合并后调用网络
+    batched = MCTSNode(go, -1, None)
+    MCTS(batched, fakePolicy, fakePlayout, fakeValue, iterations=64, selection='puct', threads=2, batchSize=8)
+    assert batched.N == 64
+    for index in range(batched.tree.count):
+        if batched.tree.N[index]:
+            assert batched.tree.N[index] == batched.tree.N[batched.tree.childSlice(index)].sum() + 1
+
+    # 根并行：每个进程从 root 的副本继续搜索，已有的访问只算一次
+    def search(node, iterations, stop=None):
+        MCTS(node, fakePolicy, fakePlayout, fakeValue, iterations=iterations, selection='puct', stop=stop)
+
+    best = MCTSRootParallel(root, search, 2, 10)
+    merged = best.parent
+    assert merged.N == 48 + 2 * 10
+    assert sum(child.N for child in merged.children) == merged.N - 1
+    assert merged.go.hash == go.hash and best.color == 1
+
+    print("并行搜索测试通过")
+
+
+def test_time_control():
+    """测试 GTP 计时命令和每步的思考时间"""
+    control = TimeControl(safety_margin=1)
+    assert control.think_time(1, 0) is None
+
+    # 加拿大读秒：主时间用完后每步的时间为剩余时间除以剩余步数
+    control.set_gtp(['600', '300', '25'])
+    assert abs(control.think_time(1, 0) - (600 / ((361 * 0.6) / 2) + 300 / 25 - 1)) < 1e-9
+    control.time_left(-1, 100, 10)
+    assert abs(control.think_time(-1, 100) - (100 / 10 - 1)) < 1e-9
+    control.spend(-1, 8)
+    assert control.clocks[-1] == [0, 92, 9]
+
+    # 日本读秒：用完主时间后，每步用不超过一个读秒周期
+    control.set_kgs(['byoyomi', '10', '30', '3'])
+    control.spend(1, 12)
+    assert control.clocks[1] == [0, 30, 3]
+    assert control.think_time(1, 50, 9) == 29
+    control.spend(1, 31)
+    assert control.clocks[1][2] == 2
+
+    # 没有读秒时 byo_yomi_time > 0 且 byo_yomi_stones 为 0 表示不限时
+    control.set_gtp(['0', '1', '0'])
+    assert control.think_time(1, 0) is None
+
+    # 时间用完后搜索立即结束，返回已有的最好的子节点（没有时为 None）
+    go = Go(9)
+    root = MCTSNode(go, 1, None)
+    assert MCTS(root, fakePolicy, fakePlayout, fakeValue, iterations=1000,
+                stop=deadline_stop(time.monotonic())) is None
+    MCTS(root, fakePolicy, fakePlayout, fakeValue, iterations=1000, stop=deadline_stop(time.monotonic() + 0.2))
+    assert 0 < root.N < 1000
+
+    print("计时测试通过")
+
+
+def test_transpositions():
+    """测试置换表：不同走法到达的同一局面共用子节点和评估"""
+    go = Go(9)
+    calls = []
+
+    def policy(position, willPlayColor, symmetries=1):
+        # 集中在几个点上的策略，搜索会以不同的顺序下这几手
+        calls.append(position.hash)
+        predict = fakePolicy(position, willPlayColor)
+        predict[[10, 20, 30, 40, 50, 60]] += 8
+        return predict
+
+    np.random.seed(0)
+    root = MCTSNode(go, 1, None)
+    MCTS(root, policy, fakePlayout, fakeValue, iterations=200, selection='puct', transpositions=True)
+    tree = root.tree
+
+    # 命中置换表的叶节点不调用网络，回传已有的平均价值
+    assert root.N == 200 and len(calls) < 200
+    assert len(tree.transpositions) == len(calls)
+    assert sum(child.N for child in root.children) == 199
+
+    # 同一段子节点被多个节点共用（有向无环图），parent 只记录第一次展开的节点
+    expanded = np.flatnonzero(tree.childCount[:tree.count] > 0)
+    firstChildren = tree.firstChild[expanded]
+    assert len(np.unique(firstChildren)) < len(expanded)
+    assert tree.go.hash == go.hash and tree.go.undoStack == []
+
+    # 复用子树时共用的子节点只复制一次，复制过来的节点仍在置换表中
+    best = max(root.children, key=lambda child: child.N)
+    go.move(1, *best.move)
+    reused = reuseTree(root, go, -1).tree
+    copied = np.flatnonzero(reused.childCount[:reused.count] > 0)
+    blocks, unique = np.unique(reused.firstChild[copied], return_index=True)
+    assert reused.count == 1 + reused.childCount[copied][unique].sum()
+    assert len(blocks) < len(copied) and reused.count < tree.count
+    assert reused.transpositions and all(reused.N[owner] > 0 for owner in reused.transpositions.values())
+
+    print("置换表测试通过")
+
+
+def test_transposition_cycles():
+    """测试置换表不会形成环：小棋盘上提子和打劫使局面重复，搜索仍然结束"""
+    for batchSize in (1, 8):
+        np.random.seed(0)
+        root = MCTSNode(Go(4), 1, None)
+        MCTS(root, fakePolicy, fakePlayout, fakeValue, iterations=300, selection='puct', batchSize=batchSize,
+             transpositions=True, rolloutDepth=1)
+        tree = root.tree
+        assert root.N == 300
+
+        # 从每个展开过的节点的子节点出发都回不到它自己
+        for index in np.flatnonzero(tree.childCount[:tree.count] > 0):
+            assert not tree.reaches(tree.firstChild[index], tree.childCount[index], index)
+
+    # 共用的子节点能回到要共用它们的节点时不共用
+    go = Go(4)
+    tree = MCTSTree(go, 1)
+    tree.transpositions = {}
+    first = tree.addChildren(0, [0, 1])
+    grandchild = tree.addChildren(first, [2])
+    tree.N[:tree.count] = 1
+    tree.transpositions[transpositionKey(go, 1)] = 0
+    assert tree.transposition(grandchild, go) == (transpositionKey(go, 1), None)
+    assert tree.childCount[grandchild] == 0
+
+    # 回传时路径中重复的节点只算一次
+    tree.backup([0, first, 0], 1)
+    assert tree.N[0] == 2 and tree.valueSum[0] == 1
+
+    print("置换表环测试通过")
+
+
+def test_evaluation_cache():
+    """测试网络评估结果的 LRU 缓存"""
+    entry = result_bytes(torch.zeros(82))
+    cache = EvaluationCache(max_bytes=3 * entry)
+    for key in range(3):
+        cache.put(key, torch.full((82,), float(key)))
+    assert len(cache) == 3 and cache.bytes == 3 * entry
+
+    # 访问过的条目变为最近使用，超出内存上限时淘汰最久没有使用的
+    assert cache.get(0)[0] == 0
+    cache.put(3, torch.zeros(82))
+    assert cache.get(1) is None and cache.get(0) is not None and cache.get(3) is not None
+    assert cache.hits == 3 and cache.misses == 1
+    assert cache.bytes <= cache.max_bytes
+
+    # 上限为 0 时不缓存
+    disabled = EvaluationCache(max_bytes=0)
+    disabled.put(0, 0.5)
+    assert disabled.get(0) is None and len(disabled) == 0
+
+    print("评估缓存测试通过")
+
+
+def test_rollouts():
+    """测试向量化抽样和模拟步数"""
+    np.random.seed(0)
+    predicts = np.log(np.tile([0.1, 0.2, 0.3, 0.4], (4000, 1)))
+    masks = np.ones((4000, 4), dtype=bool)
+    masks[:2000, 3] = False
+    masks[2000:, :3] = False
+    digits = sampleMoves(predicts, masks)
+
+    # 只选合法的落子，频率与合法落子中的概率成正比
+    assert (digits[2000:] == 3).all()
+    counts = np.bincount(digits[:2000], minlength=4) / 2000
+    assert counts[3] == 0 and np.abs(counts[:3] - [1 / 6, 2 / 6, 3 / 6]).max() < 0.05
+
+    # 概率全部下溢时在合法落子中均匀选择
+    assert sampleMoves(np.array([[-1e4, -1e4, 0.0]]), np.array([[True, True, False]]))[0] in (0, 1)
+
+    # 模拟步数为 0 时不调用快速策略网络，只用价值网络评估叶节点
+    go = Go(9)
+    calls = []
+
+    def playout(position, willPlayColor):
+        calls.append(willPlayColor)
+        return fakePlayout(position, willPlayColor)
+
+    for batchSize, depth in ((1, 0), (4, 0), (1, 2), (4, 3)):
+        calls.clear()
+        root = MCTSNode(go, 1, None)
+        MCTS(root, fakePolicy, playout, fakeValue, iterations=20, selection='puct', batchSize=batchSize,
+             rolloutDepth=depth)
+        assert root.N == 20 and len(calls) == 20 * depth
+
+    print("模拟测试通过")